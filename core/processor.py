@@ -1,91 +1,267 @@
-import json
+import asyncio
 import logging
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import aiohttp
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 from core.storage import EventStorage
+from isapi.isapi_client import ISAPIEvent
+from utils.json_codec import dumps
+
+_PARSE_WARN_INTERVAL = 60.0
+_PARSE_WARN_MAX_PEERS = 1024
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# Pending events re-sent to 1C at once during a retry round
+_RETRY_CONCURRENCY = 20
+# Default cap on simultaneous POSTs to one tenant's 1C (c1.max_concurrency)
+_C1_MAX_CONCURRENCY = 16
+
+
+@lru_cache(maxsize=1024)
+def _iso_timestamp(ts: datetime) -> str:
+    """
+    Event timestamps have one-second resolution and arrive in bursts: format each once.
+    """
+    return ts.isoformat()
 
 
 class EventProcessor:
-    def __init__(self, tenant_manager, terminal_manager, storage: EventStorage, metrics, logger, isup_parser):
+    def __init__(
+        self,
+        tenant_manager,
+        terminal_manager,
+        storage: EventStorage,
+        metrics,
+        logger,
+        isup_parser,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
         self.tm = tenant_manager
         self.terminal_manager = terminal_manager
         self.storage = storage
         self.metrics = metrics
         self.log = logger
         self.isup_parser = isup_parser
+        self._parse_warned: Dict[str, Tuple[float, int]] = {}
+        # object_id -> (1C URL, BasicAuth, POST semaphore); tenant config does not change at runtime
+        self._c1_targets: Dict[str, Tuple[str, aiohttp.BasicAuth, asyncio.Semaphore]] = {}
+        # 1C requests reuse one connection pool (borrowed if passed in, else created lazily)
+        self._session = session
+        self._owns_session = session is None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._owns_session = True
+            self._session = aiohttp.ClientSession()
+        return self._session
 
-    async def process_isup_packet(self, raw_packet: bytes, ip: str):
-        event = self.isup_parser.parse(raw_packet)
+    async def close(self):
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
+
+    async def process_isup_packet(self, raw_packet: Union[bytes, memoryview], ip: str, header=None):
+        """
+        raw_packet may be a memoryview slice of the connection's read buffer
+        (never overwritten, but it keeps that buffer alive while referenced).
+        header, when given, is the packet's header as already parsed by the framing loop.
+        """
+        event = self.isup_parser.parse(raw_packet, header)
         self.metrics.events_received += 1
         if event:
             self.metrics.events_parsed += 1
             self.metrics.last_event_time = event.timestamp
-            await self._dispatch_event(
-                {
-                    "source": "ISUP",
-                    "device_id": event.header.device_id,
-                    "ip": ip,
-                    "timestamp": event.timestamp.isoformat(),
-                    "card": event.card_number,
-                    "direction": event.direction.name,
-                    "result": event.verify_result,
-                }
-            )
+            await self._dispatch_event(self._isup_payload(event, ip))
+        else:
+            self._warn_parse_failure(ip)
+
+    async def save_isup_packets(self, packets: List[Tuple[Union[bytes, memoryview], Any]], ip: str):
+        """
+        Store (packet, header) pairs as pending events without sending them (shutdown path:
+        the terminal was already acked, so the pending retry delivers them later).
+        """
+        payloads = []
+        for raw_packet, header in packets:
+            event = self.isup_parser.parse(raw_packet, header)
+            if event:
+                payloads.append(self._isup_payload(event, ip))
+        await self._save_unsent(payloads)
+
+    @staticmethod
+    def _isup_payload(event, ip: str) -> dict:
+        return {
+            "source": "ISUP",
+            "device_id": event.header.device_id,
+            "ip": ip,
+            "timestamp": _iso_timestamp(event.timestamp),
+            "card": event.card_number,
+            "direction": event.direction.name,
+            "result": event.verify_result,
+        }
+
+    def _warn_parse_failure(self, ip: str):
+        """
+        At most one "failed to parse" warning per peer per _PARSE_WARN_INTERVAL, with
+        a count of the suppressed ones, so a broken terminal or a scanner cannot flood the log.
+        """
+        now = time.monotonic()
+        last, suppressed = self._parse_warned.get(ip, (None, 0))
+        if last is not None and now - last < _PARSE_WARN_INTERVAL:
+            self._parse_warned[ip] = (last, suppressed + 1)
+            return
+        if suppressed:
+            self.log.warning("Failed to parse ISUP packet from %s (%d more suppressed)", ip, suppressed)
         else:
             self.log.warning("Failed to parse ISUP packet from %s", ip)
+        if len(self._parse_warned) >= _PARSE_WARN_MAX_PEERS:
+            self._parse_warned.clear()
+        self._parse_warned[ip] = (now, 0)
+
+    async def process_isapi_event(self, event: Union[ISAPIEvent, Dict[str, Any]], ip: str):
+        await self._dispatch_event(self._isapi_payload(event, ip))
 
-    async def process_isapi_event(self, event: dict, ip: str):
-        await self._dispatch_event(
-            {
-                "source": "ISAPI",
-                **event,
-                "ip": ip,
-            }
+    async def save_isapi_events(self, batch: List[Tuple[Union[ISAPIEvent, Dict[str, Any]], str]]):
+        """
+        Store (event, ip) pairs as pending events without sending them (shutdown path:
+        the device already got its 200, so the pending retry delivers them later).
+        """
+        await self._save_unsent([self._isapi_payload(event, ip) for event, ip in batch])
+
+    @staticmethod
+    def _isapi_payload(event: Union[ISAPIEvent, Dict[str, Any]], ip: str) -> dict:
+        if isinstance(event, ISAPIEvent):
+            # Straight from the webhook parser: build the payload once, no intermediate dict
+            return event.to_dict(source="ISAPI", client_ip=ip)
+        return {
+            "source": "ISAPI",
+            **event,
+            "ip": ip,
+        }
+
+    async def process_isapi_events(self, batch: List[Tuple[Union[ISAPIEvent, Dict[str, Any]], str]]):
+        """
+        Dispatch a batch of (event, ip) pairs queued by the ISAPI webhook concurrently.
+        """
+        results = await asyncio.gather(
+            *(self.process_isapi_event(event, ip) for event, ip in batch),
+            return_exceptions=True,
         )
+        for res in results:
+            if isinstance(res, Exception):
+                self.log.error("ISAPI event processing failed: %s", res)
 
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=1, max=10),
         retry=retry_if_exception_type(aiohttp.ClientError),
     )
-    async def _send_to_1c(self, url: str, payload: dict, auth):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, auth=auth) as resp:
-                if resp.status >= 400:
-                    txt = await resp.text()
-                    self.log.error("1C Error %s: %s", resp.status, txt)
-                    resp.raise_for_status()
-                self.metrics.events_sent_to_1c += 1
+    async def _send_to_1c(self, url: str, payload: dict, auth, limit: Optional[asyncio.Semaphore] = None):
+        """
+        limit bounds in-flight POSTs to the tenant's 1C; it is held per attempt, not across backoff waits.
+        """
+        if limit is not None:
+            async with limit:
+                await self._post_to_1c(url, payload, auth)
+        else:
+            await self._post_to_1c(url, payload, auth)
 
-    async def _dispatch_event(self, event_data: dict):
+    async def _post_to_1c(self, url: str, payload: dict, auth):
+        session = self._get_session()
+        async with session.post(url, data=dumps(payload), headers=_JSON_HEADERS, auth=auth) as resp:
+            if resp.status >= 400:
+                txt = await resp.text()
+                self.log.error("1C Error %s: %s", resp.status, txt)
+                resp.raise_for_status()
+            self.metrics.events_sent_to_1c += 1
+
+    def _tenant_for(self, event_data: dict) -> Optional[dict]:
         # TODO: improve matching logic between device/IP and tenant
-        tenant = next(iter(self.tm.tenants.values()), None)
+        return next(iter(self.tm.tenants.values()), None)
+
+    async def _save_unsent(self, payloads: List[dict]):
+        """
+        Called from tasks that are being cancelled: the saves run in their own task and a
+        repeated cancellation (server stop, then loop teardown) does not cut them short.
+        A cancellation that arrived meanwhile is re-raised once the saves are done.
+        """
+        if not payloads:
+            return
+        saving = asyncio.ensure_future(self._save_all(payloads))
+        cancelled = False
+        while not saving.done():
+            try:
+                await asyncio.wait({saving})
+            except asyncio.CancelledError:
+                cancelled = True
+        if cancelled:
+            if not saving.cancelled() and saving.exception() is not None:
+                self.log.error("Failed to save unsent events: %s", saving.exception())
+            raise asyncio.CancelledError
+        saving.result()
+
+    async def _save_all(self, payloads: List[dict]):
+        for event_data in payloads:
+            tenant = self._tenant_for(event_data)
+            await self.storage.save_event(event_data, tenant.get("object_id", "unknown") if tenant else "unknown")
+
+    async def _dispatch_event(self, event_data: dict):
+        tenant = self._tenant_for(event_data)
         if not tenant:
             self.log.error("No tenant found for event")
             return
 
-        c1_cfg = tenant.get("c1", {})
-        url = f"{c1_cfg.get('base_url')}{c1_cfg.get('endpoint')}"
-        auth = aiohttp.BasicAuth(c1_cfg.get("username"), c1_cfg.get("password"))
+        url, auth, limit = self._c1_target(tenant)
 
         try:
-            await self._send_to_1c(url, event_data, auth)
+            await self._send_to_1c(url, event_data, auth, limit)
             self.log.info("Event sent to 1C: %s", event_data)
         except Exception as e:
             self.metrics.events_failed += 1
             self.log.error("Failed to send to 1C, saving to storage: %s", e)
             await self.storage.save_event(event_data, tenant.get("object_id", "unknown"))
 
+    def _c1_target(self, tenant: dict) -> Tuple[str, aiohttp.BasicAuth, asyncio.Semaphore]:
+        key = tenant.get("object_id")
+        target = self._c1_targets.get(key)
+        if target is None:
+            c1_cfg = tenant.get("c1", {})
+            target = (
+                f"{c1_cfg.get('base_url')}{c1_cfg.get('endpoint')}",
+                aiohttp.BasicAuth(c1_cfg.get("username"), c1_cfg.get("password")),
+                asyncio.Semaphore(int(c1_cfg.get("max_concurrency", _C1_MAX_CONCURRENCY))),
+            )
+            self._c1_targets[key] = target
+        return target
+
     async def retry_pending_events(self):
         self.log.debug("Checking pending events...")
         files = await self.storage.get_pending_events()
-        for f in files:
-            try:
-                with open(f, "r", encoding="utf-8") as file:
-                    event = json.load(file)
-                await self._dispatch_event(event)
-                await self.storage.delete_event(f)
-            except Exception as e:  # pragma: no cover - defensive
-                self.log.error("Retry failed for %s: %s", f, e)
+        if not files:
+            return
+        # A slow 1C response holds up one slot, not the whole backlog
+        sem = asyncio.Semaphore(_RETRY_CONCURRENCY)
+
+        async def _retry(f: str):
+            async with sem:
+                try:
+                    # Another bridge process sharing the storage directory may have taken it
+                    claimed = await self.storage.claim_event(f)
+                    if claimed is None:
+                        return
+                    dispatched = False
+                    try:
+                        event = await self.storage.load_event(claimed)
+                        await self._dispatch_event(event)
+                        dispatched = True
+                    finally:
+                        # Cancelled (shutdown) or failed before the send finished: back to pending
+                        if not dispatched:
+                            self.storage.release_event(claimed)
+                    await self.storage.delete_event(claimed)
+                except Exception as e:  # pragma: no cover - defensive
+                    self.log.error("Retry failed for %s: %s", f, e)
+
+        await asyncio.gather(*(_retry(f) for f in files))
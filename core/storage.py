@@ -1,8 +1,52 @@
-import json
+import asyncio
+import itertools
 import logging
-from datetime import datetime, timedelta
+import os
+import time
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+from utils.json_codec import dumps, loads
+
+# A retry claims a pending file by renaming it to <name>.claimed-<pid>-<epoch>, so bridge
+# processes sharing the directory (one host, SO_REUSEPORT) never send the same event twice.
+# An interrupted retry renames the file back; a claim left by a dead process, by an earlier
+# process with our pid (container restart) or older than _CLAIM_TTL is picked up again.
+_CLAIM_MARK = ".json.claimed-"
+_CLAIM_TTL = 3600
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill() would terminate the process on Windows; stale claims wait for the TTL there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _claim_is_stale(owner: str, now: float) -> bool:
+    pid, _, claimed_at = owner.partition("-")
+    if now - int(claimed_at) >= _CLAIM_TTL:
+        return True
+    # Retry rounds never overlap, so a claim carrying our own pid is left over from a previous process
+    return int(pid) == os.getpid() or not _pid_alive(int(pid))
+
+
+def _write_event(filename: Path, data: bytes):
+    # Written under a temporary name and renamed: a scan never sees a half-written file
+    tmp = filename.with_name(filename.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, filename)
+
+
+def _read_event(filepath: str) -> Dict:
+    with open(filepath, "rb") as file:
+        return loads(file.read())
 
 
 class EventStorage:
@@ -11,40 +55,97 @@ class EventStorage:
         self.storage_path.mkdir(parents=True, exist_ok=True)
         self.logger = logger
         self.max_pending_days = max_pending_days
+        # pid + counter keep names unique within the same second (and across restarts)
+        self._name_prefix = f"{os.getpid()}-"
+        self._seq = itertools.count()
 
     async def save_event(self, event: Dict, tenant_id: str):
         if not self.storage_path:
             return
 
-        filename = self.storage_path / f"pending_{tenant_id}_{int(datetime.now().timestamp())}.json"
+        # The trailing epoch second is what _scan_pending reads back for expiry
+        filename = (
+            self.storage_path / f"pending_{tenant_id}_{self._name_prefix}{next(self._seq)}_{int(time.time())}.json"
+        )
         try:
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(event, f, ensure_ascii=False, indent=2)
+            # Compact JSON, written off the event loop thread
+            await asyncio.to_thread(_write_event, filename, dumps(event))
         except Exception as e:  # pragma: no cover - defensive
-            self.logger.error(f"Failed to save pending event: {e}")
+            self.logger.error("Failed to save pending event: %s", e)
 
     async def get_pending_events(self) -> List[str]:
-        if not self.storage_path.exists():
-            return []
+        # Directory walk (and expiry unlinks) run in a worker thread, off the event loop
+        return await asyncio.to_thread(self._scan_pending)
 
-        cutoff = datetime.now() - timedelta(days=self.max_pending_days)
+    def _scan_pending(self) -> List[str]:
+        """
+        One os.scandir pass; the expiry timestamp comes from the file name, so no stat() per file.
+        """
+        now = time.time()
+        cutoff = now - self.max_pending_days * 86400
         pending = []
-        for file_path in self.storage_path.glob("pending_*.json"):
-            try:
-                ts = int(file_path.stem.split("_")[-1])
-                if datetime.fromtimestamp(ts) >= cutoff:
-                    pending.append(str(file_path))
-                else:
-                    file_path.unlink(missing_ok=True)
-            except Exception as exc:  # pragma: no cover - defensive
-                self.logger.warning(f"Skipping pending file {file_path}: {exc}")
+        try:
+            entries = os.scandir(self.storage_path)
+        except FileNotFoundError:
+            return []
+        with entries:
+            for entry in entries:
+                name = entry.name
+                if not name.startswith("pending_"):
+                    continue
+                try:
+                    if name.endswith(".json"):
+                        stem = name[:-5]
+                    else:
+                        stem, mark, owner = name.rpartition(_CLAIM_MARK)
+                        if not mark or not _claim_is_stale(owner, now):
+                            continue
+                    ts = int(stem.rsplit("_", 1)[-1])
+                    if ts >= cutoff:
+                        pending.append(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+                except Exception as exc:  # pragma: no cover - defensive
+                    self.logger.warning("Skipping pending file %s: %s", entry.path, exc)
         return pending
 
+    async def claim_event(self, filepath: str) -> Optional[str]:
+        """
+        Take a pending file for this process (atomic rename). Returns the claimed path,
+        or None when another process claimed it first.
+        """
+        head, mark, _ = filepath.rpartition(_CLAIM_MARK)
+        stem = head if mark else filepath[:-5]
+        claimed = f"{stem}{_CLAIM_MARK}{os.getpid()}-{int(time.time())}"
+        try:
+            await asyncio.to_thread(os.rename, filepath, claimed)
+        except FileNotFoundError:
+            return None
+        return claimed
+
+    def release_event(self, claimed: str):
+        """
+        Give a claimed file back as pending. Synchronous on purpose: it runs on the
+        cancellation path, where a further await could be cut short.
+        """
+        stem = claimed.rpartition(_CLAIM_MARK)[0]
+        try:
+            os.rename(claimed, f"{stem}.json")
+        except FileNotFoundError:
+            pass
+        except Exception as e:  # pragma: no cover - defensive
+            self.logger.error("Failed to release pending event file %s: %s", claimed, e)
+
+    async def load_event(self, filepath: str) -> Dict:
+        return await asyncio.to_thread(_read_event, filepath)
+
     async def delete_event(self, filepath: str):
         try:
-            Path(filepath).unlink(missing_ok=True)
+            await asyncio.to_thread(Path(filepath).unlink, missing_ok=True)
         except Exception as e:  # pragma: no cover - defensive
-            self.logger.error(f"Failed to delete pending event file {filepath}: {e}")
+            self.logger.error("Failed to delete pending event file %s: %s", filepath, e)
 
     async def close(self):
         pass
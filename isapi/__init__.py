@@ -1,5 +1,4 @@
 from isapi.isapi_client import ISAPIDeviceClient, DeviceInfo
-from isapi.isapi_device_manager import ISAPIDeviceManager
 from isapi.isapi_server import ISAPITerminalManager, ISAPIWebhookHandler, ISAPIWebhookServer
 
 __all__ = [
@@ -10,3 +9,12 @@ __all__ = [
     "ISAPIWebhookHandler",
     "ISAPIWebhookServer",
 ]
+
+
+def __getattr__(name):
+    # The device manager is only needed with auto_configure_terminals: load it on first use
+    if name == "ISAPIDeviceManager":
+        from isapi.isapi_device_manager import ISAPIDeviceManager
+
+        return ISAPIDeviceManager
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -10,20 +10,32 @@ Includes:
 Notes:
 - Hikvision firmwares commonly require Digest Auth (RFC 7616), Basic is often rejected.
 - aiohttp does not provide a stable public DigestAuth helper, so we implement it.
+- lxml is used for event XML when installed (several times faster than stdlib
+  ElementTree); otherwise we fall back to xml.etree.ElementTree.
 """
 
 import hashlib
 import logging
 import os
 import re
+from collections import deque
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, Sequence, Dict, Any, Tuple
+from functools import lru_cache
+from typing import Optional, Sequence, Dict, Any, List, Mapping, Tuple, Union
 from urllib.parse import urlsplit, urlparse
 
 import aiohttp
 import xml.etree.ElementTree as ET
 
+try:
+    from lxml import etree as _lxml_etree
+except ImportError:  # pragma: no cover - optional dependency
+    _lxml_etree = None
+
+# to_dict() default for client_ip: keep the device-reported ipAddress
+_DEVICE_IP: Any = object()
 
 # ============================================================================
 # ISAPI Event Structures
@@ -32,7 +44,27 @@ import xml.etree.ElementTree as ET
 class ISAPIEvent:
     """
     Normalized ISAPI event for downstream processing.
+    Slotted: one instance per webhook event, no per-instance __dict__.
     """
+    __slots__ = (
+        "event_type",
+        "event_state",
+        "device_id",
+        "mac_address",
+        "ip_address",
+        "timestamp",
+        "card_number",
+        "employee_number",
+        "door_id",
+        "reader_id",
+        "direction",
+        "major_event_type",
+        "minor_event_type",
+        "success",
+        "image_ids",
+        "raw_xml",
+    )
+
     def __init__(
         self,
         event_type: str,
@@ -49,9 +81,9 @@ class ISAPIEvent:
         major_event_type: Optional[str],
         minor_event_type: Optional[str],
         success: bool,
-        image_ids: Optional[list],
-        raw_xml: str,
-    ):
+        image_ids: Optional[List[str]],
+        raw_xml: Union[str, bytes],
+    ) -> None:
         self.event_type = event_type
         self.event_state = event_state
         self.device_id = device_id
@@ -69,16 +101,21 @@ class ISAPIEvent:
         self.minor_event_type = minor_event_type
         self.success = success
 
-        self.image_ids = image_ids or []
+        self.image_ids: List[str] = image_ids or []
         self.raw_xml = raw_xml
 
-    def to_dict(self) -> Dict[str, Any]:
-        return {
+    def to_dict(self, source: Optional[str] = None, client_ip: Optional[str] = _DEVICE_IP) -> Dict[str, Any]:
+        """
+        source / client_ip let the processor build its outgoing payload in one pass, in the
+        wire shape it always sent: source first, ip replaced by client_ip whenever passed (even None).
+        """
+        data: Dict[str, Any] = {"source": source} if source else {}
+        data.update({
             "event_type": self.event_type,
             "event_state": self.event_state,
             "device_id": self.device_id,
             "mac": self.mac_address,
-            "ip": self.ip_address,
+            "ip": self.ip_address if client_ip is _DEVICE_IP else client_ip,
             "timestamp": self.timestamp,
             "card": self.card_number,
             "employee": self.employee_number,
@@ -89,7 +126,59 @@ class ISAPIEvent:
             "minor_event_type": self.minor_event_type,
             "success": self.success,
             "images": self.image_ids,
-        }
+        })
+        return data
+
+
+_ALERT_FIELDS = frozenset(("eventType", "eventState", "deviceID", "macAddress", "ipAddress", "dateTime"))
+_ACCESS_FIELDS = frozenset(
+    ("cardNo", "cardNoHex", "employeeNo", "doorID", "readerID", "majorEventType", "minorEventType")
+)
+_XML_FEED_CHUNK = 32 * 1024
+_PULL_PARSER_POOL_SIZE = 32
+_PULL_PARSER_POOL: deque = deque()
+
+
+@contextmanager
+def _borrow_pull_parser():
+    """
+    Reuse lxml pull parsers across alerts instead of re-creating libxml2 state per call.
+    A parser is reusable once close() has reset it; one that raised is dropped, since
+    libxml2 may keep error state around.
+    """
+    try:
+        parser = _PULL_PARSER_POOL.pop()
+    except IndexError:
+        parser = _lxml_etree.XMLPullParser(
+            events=("end",), collect_ids=False, resolve_entities=False, no_network=True
+        )
+    yield parser
+    if len(_PULL_PARSER_POOL) < _PULL_PARSER_POOL_SIZE:
+        _PULL_PARSER_POOL.append(parser)
+
+
+@lru_cache(maxsize=256)
+def _reader_direction(reader_id: str) -> str:
+    """
+    Direction heuristic (project-specific): odd reader -> IN, even -> OUT.
+    A terminal only has a handful of reader IDs, so the conversion is cached.
+    """
+    try:
+        return "IN" if int(reader_id) % 2 == 1 else "OUT"
+    except Exception:
+        return "UNKNOWN"
+
+
+def _utf8_replaced(data: bytes) -> Optional[bytes]:
+    """
+    data with invalid UTF-8 sequences replaced by U+FFFD (what decoding with errors="replace"
+    before parsing used to do), or None when data is already valid UTF-8.
+    """
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("utf-8", errors="replace").encode("utf-8")
+    return None
 
 
 class ISAPIEventParser:
@@ -100,7 +189,76 @@ class ISAPIEventParser:
     def __init__(self, logger: Optional[logging.Logger] = None):
         self.log = logger or logging.getLogger("isapi.parser")
 
-    def parse(self, xml_text: str, images: Optional[Dict[str, bytes]] = None) -> Optional[ISAPIEvent]:
+    def _read_fields(self, data: bytes) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        Returns (alert-level fields, first AccessControllerEvent's fields) with
+        findtext() semantics: first matching child, "" for an empty element.
+        """
+        if _lxml_etree is not None:
+            return self._stream_fields(data)
+
+        root = ET.fromstring(data)
+        alert = {tag: text for tag in _ALERT_FIELDS if (text := root.findtext(tag)) is not None}
+        access: Dict[str, str] = {}
+        access_node = root.find("AccessControllerEvent")
+        if access_node is not None:
+            access = {tag: text for tag in _ACCESS_FIELDS if (text := access_node.findtext(tag)) is not None}
+        return alert, access
+
+    @staticmethod
+    def _stream_fields(data: bytes) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        lxml pull parsing: fields are picked up as elements close and every
+        finished top-level subtree is dropped, so memory stays flat however
+        large the alert document is.
+        """
+        with _borrow_pull_parser() as parser:
+            return ISAPIEventParser._pull_fields(parser, data)
+
+    @staticmethod
+    def _pull_fields(parser, data: bytes) -> Tuple[Dict[str, str], Dict[str, str]]:
+        alert: Dict[str, str] = {}
+        access: Dict[str, str] = {}
+        first_access = None
+
+        def consume():
+            nonlocal first_access
+            for _, elem in parser.read_events():
+                parent = elem.getparent()
+                if parent is None:
+                    continue  # root closed
+                tag = elem.tag
+                grandparent = parent.getparent()
+                if grandparent is None:
+                    # Direct child of the alert root
+                    if tag in _ALERT_FIELDS and tag not in alert:
+                        alert[tag] = elem.text or ""
+                    elif tag == "AccessControllerEvent" and first_access is None:
+                        first_access = elem
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del parent[0]
+                elif grandparent.getparent() is None and parent.tag == "AccessControllerEvent":
+                    if first_access is None:
+                        first_access = parent
+                    if parent is first_access and tag in _ACCESS_FIELDS and tag not in access:
+                        access[tag] = elem.text or ""
+                    # Text is taken; nested content of the field is not needed any more
+                    elem.clear()
+
+        for pos in range(0, len(data), _XML_FEED_CHUNK):
+            parser.feed(data[pos: pos + _XML_FEED_CHUNK])
+            consume()
+        parser.close()
+        consume()
+        return alert, access
+
+    def parse(self, xml_text: Union[str, bytes], images: Optional[Mapping[str, Any]] = None) -> Optional[ISAPIEvent]:
+        """
+        Accepts the raw XML bytes straight from the request (preferred: no decode pass)
+        or an already decoded str. Only the image names are used, so `images` may map
+        them to bytes or just to sizes.
+        """
         if not xml_text:
             return None
 
@@ -108,53 +266,44 @@ class ISAPIEventParser:
         if not xml_text:
             return None
 
+        data = xml_text.encode("utf-8") if isinstance(xml_text, str) else xml_text
         try:
-            root = ET.fromstring(xml_text)
+            alert, access = self._read_fields(data)
         except Exception as e:
-            self.log.warning("ISAPI XML parse error: %s", e)
-            return None
-
-        event_type = root.findtext("eventType") or "unknown"
-        event_state = root.findtext("eventState") or "unknown"
-        device_id = root.findtext("deviceID")
-        mac_address = root.findtext("macAddress")
-        ip_address = root.findtext("ipAddress")
-        timestamp = root.findtext("dateTime") or datetime.now().isoformat()
-
-        device_id_final = mac_address or device_id or "unknown"
-
-        access_node = root.find("AccessControllerEvent")
-
-        card_no = None
-        employee_no = None
-        door_id = None
-        reader_id = None
-        major_event_type = None
-        minor_event_type = None
-        direction = "UNKNOWN"
-        success = False
-
-        if access_node is not None:
-            card_no = access_node.findtext("cardNo") or access_node.findtext("cardNoHex")
-            employee_no = access_node.findtext("employeeNo")
-            door_id = access_node.findtext("doorID")
-            reader_id = access_node.findtext("readerID")
-            major_event_type = access_node.findtext("majorEventType")
-            minor_event_type = access_node.findtext("minorEventType")
-
-            # Direction heuristic (project-specific)
+            # Devices put legacy-encoded bytes (GBK, CP1251) into a UTF-8 document, e.g. in
+            # deviceName: retry once with those bytes replaced rather than reject the event
+            repaired = _utf8_replaced(data)
+            if repaired is None:
+                self.log.warning("ISAPI XML parse error: %s", e)
+                return None
             try:
-                if reader_id:
-                    rid = int(reader_id)
-                    direction = "IN" if rid % 2 == 1 else "OUT"
-            except Exception:
-                direction = "UNKNOWN"
-
-            # Success heuristic (adjust according to your event dictionary)
-            # Some devices use "1" for success; others use boolean-ish fields.
-            success = (minor_event_type == "1")
-
-        image_ids = list(images.keys()) if images else []
+                alert, access = self._read_fields(repaired)
+            except Exception as e2:
+                self.log.warning("ISAPI XML parse error: %s", e2)
+                return None
+
+        event_type: str = alert.get("eventType") or "unknown"
+        event_state: str = alert.get("eventState") or "unknown"
+        device_id: Optional[str] = alert.get("deviceID")
+        mac_address: Optional[str] = alert.get("macAddress")
+        ip_address: Optional[str] = alert.get("ipAddress")
+        timestamp: str = alert.get("dateTime") or datetime.now().isoformat()
+
+        device_id_final: str = mac_address or device_id or "unknown"
+
+        card_no: Optional[str] = access.get("cardNo") or access.get("cardNoHex")
+        employee_no: Optional[str] = access.get("employeeNo")
+        door_id: Optional[str] = access.get("doorID")
+        reader_id: Optional[str] = access.get("readerID")
+        major_event_type: Optional[str] = access.get("majorEventType")
+        minor_event_type: Optional[str] = access.get("minorEventType")
+        direction: str = _reader_direction(reader_id) if reader_id else "UNKNOWN"
+
+        # Success heuristic (adjust according to your event dictionary)
+        # Some devices use "1" for success; others use boolean-ish fields.
+        success: bool = (minor_event_type == "1")
+
+        image_ids: List[str] = list(images.keys()) if images else []
 
         return ISAPIEvent(
             event_type=event_type,
@@ -231,6 +380,43 @@ class DigestAuth:
 
         self._nc = 0
         self._cnonce: Optional[str] = None
+        self._ha1: Optional[str] = None
+
+    @property
+    def has_challenge(self) -> bool:
+        """True once a server challenge was seen, so the header can be sent preemptively."""
+        return bool(self.realm and self.nonce)
+
+    def export_state(self) -> Dict[str, Any]:
+        """
+        Challenge state worth persisting between runs (no credentials / HA1).
+        """
+        if not self.has_challenge:
+            return {}
+        return {
+            "realm": self.realm,
+            "nonce": self.nonce,
+            "opaque": self.opaque,
+            "algorithm": self.algorithm,
+            "qop": self.qop,
+            "nc": self._nc,
+        }
+
+    def load_state(self, state: Optional[Dict[str, Any]]) -> bool:
+        """
+        Restore a previously exported challenge so the first request can be signed preemptively.
+        A stale nonce just costs the usual 401 -> retry.
+        """
+        if not state or not state.get("realm") or not state.get("nonce"):
+            return False
+        self.realm = state["realm"]
+        self.nonce = state["nonce"]
+        self.opaque = state.get("opaque")
+        self.algorithm = (state.get("algorithm") or "MD5").upper()
+        self.qop = state.get("qop")
+        self._nc = int(state.get("nc") or 0)
+        self._ha1 = _hash(self.algorithm, f"{self.username}:{self.realm}:{self.password}")
+        return True
 
     def _new_cnonce(self) -> str:
         return os.urandom(8).hex()
@@ -250,15 +436,18 @@ class DigestAuth:
             return False
 
         stale = (params.get("stale") or "").lower() == "true"
+        nonce = params.get("nonce")
 
         self.realm = params.get("realm")
-        self.nonce = params.get("nonce")
         self.opaque = params.get("opaque")
         self.algorithm = (params.get("algorithm") or "MD5").upper()
         self.qop = self._select_qop(params.get("qop"))
+        # HA1 for non-session algorithms depends only on user/realm/password
+        self._ha1 = _hash(self.algorithm, f"{self.username}:{self.realm}:{self.password}")
 
-        if stale:
+        if stale or nonce != self.nonce:
             self._nc = 0
+        self.nonce = nonce
         return True
 
     def build_authorization_header(self, method: str, url: str) -> str:
@@ -278,7 +467,7 @@ class DigestAuth:
         qop = self.qop
         alg = self.algorithm
 
-        ha1 = _hash(alg, f"{self.username}:{self.realm}:{self.password}")
+        ha1 = self._ha1 or _hash(alg, f"{self.username}:{self.realm}:{self.password}")
         if alg.endswith("-SESS"):
             ha1 = _hash(alg, f"{ha1}:{self.nonce}:{cnonce}")
 
@@ -312,6 +501,29 @@ class DigestAuth:
 # ISAPI Device Client
 # ============================================================================
 
+_EVENT_TRIGGER_TEMPLATE = """
+  <EventTriggerNotification>
+    <id>{idx}</id>
+    <eventType>{evt}</eventType>
+    <eventDescription>auto</eventDescription>
+    <protocolType>HTTP</protocolType>
+    <httpHostId>{host_id}</httpHostId>
+    <triggerState>true</triggerState>
+  </EventTriggerNotification>""".format
+
+
+@lru_cache(maxsize=32)
+def _event_trigger_entries(event_types: Tuple[str, ...], host_id: int) -> str:
+    """
+    Render <EventTriggerNotification> entries once per (event_types, host_id);
+    the same list is pushed to every terminal on auto-configure.
+    """
+    return "".join(
+        _EVENT_TRIGGER_TEMPLATE(idx=idx, evt=evt, host_id=host_id)
+        for idx, evt in enumerate(event_types, start=1)
+    )
+
+
 @dataclass
 class DeviceInfo:
     device_id: Optional[str]
@@ -321,27 +533,50 @@ class DeviceInfo:
 class ISAPIDeviceClient:
     """
     Async client for Hikvision ISAPI device configuration with RFC7616 Digest.
-    Transparent retry on 401 Digest challenge.
+    Once a challenge is known, Authorization is sent preemptively;
+    transparent retry on 401 Digest challenge (new or stale nonce).
     """
 
-    def __init__(self, host: str, port: int, username: str, password: str, logger: Optional[logging.Logger] = None):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        logger: Optional[logging.Logger] = None,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
         self.host = host
         self.port = int(port)
         self.base_url = f"http://{host}:{self.port}"
         self.log = logger or logging.getLogger("isapi.client")
 
         self._digest = DigestAuth(username or "", password or "", logger=self.log)
-        self.session = aiohttp.ClientSession()
+        # A shared session (e.g. from ISAPIDeviceManager) is borrowed, not closed by us
+        self._owns_session = session is None
+        self.session = session or aiohttp.ClientSession()
 
     async def close(self):
-        if self.session and not self.session.closed:
+        if self._owns_session and self.session and not self.session.closed:
             await self.session.close()
 
+    def digest_state(self) -> Dict[str, Any]:
+        return self._digest.export_state()
+
+    def load_digest_state(self, state: Optional[Dict[str, Any]]) -> bool:
+        return self._digest.load_state(state)
+
     async def _request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
         """
         Performs request with Digest auth retry.
+        Reuses the cached nonce so back-to-back calls skip the 401 round trip.
         """
         kwargs.pop("auth", None)  # ensure we don't pass aiohttp auth
+        if self._digest.has_challenge:
+            headers = dict(kwargs.get("headers") or {})
+            headers["Authorization"] = self._digest.build_authorization_header(method, url)
+            kwargs["headers"] = headers
+
         resp = await self.session.request(method, url, **kwargs)
         if resp.status != 401:
             return resp
@@ -448,24 +683,10 @@ class ISAPIDeviceClient:
     # ---------------------------------------------------------------------
 
     def build_event_subscription_payload(self, event_types: Sequence[str], host_id: int = 1) -> str:
-        entries = []
-        for idx, evt in enumerate(event_types, start=1):
-            entries.append(
-                f"""
-  <EventTriggerNotification>
-    <id>{idx}</id>
-    <eventType>{evt}</eventType>
-    <eventDescription>auto</eventDescription>
-    <protocolType>HTTP</protocolType>
-    <httpHostId>{host_id}</httpHostId>
-    <triggerState>true</triggerState>
-  </EventTriggerNotification>
-""".rstrip()
-            )
-
+        entries = _event_trigger_entries(tuple(event_types), host_id)
         payload = f"""
 <EventTriggerNotificationList version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">
-{''.join(entries)}
+{entries}
 </EventTriggerNotificationList>
 """.strip()
         return payload
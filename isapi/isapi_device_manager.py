@@ -1,37 +1,114 @@
+import asyncio
+import json
 import logging
-from typing import List
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiohttp
 
 from isapi.isapi_client import ISAPIDeviceClient
 
 
 class ISAPIDeviceManager:
-    def __init__(self, cfg: dict, logger: logging.Logger):
+    CONFIGURE_CONCURRENCY = 16
+
+    def __init__(self, cfg: dict, logger: logging.Logger, session: Optional[aiohttp.ClientSession] = None):
         self.cfg = cfg
         self.log = logger
         self.clients: List[ISAPIDeviceClient] = []
+        # A session passed in (process-wide pool) is borrowed and left open on close()
+        self._session: Optional[aiohttp.ClientSession] = session
+        self._owns_session = session is None
+        cache_path = cfg.get("isapi", {}).get("digest_cache")
+        self.digest_cache_path: Optional[Path] = Path(cache_path) if cache_path else None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        One pooled session for all terminals instead of a connector per device client.
+        """
+        if self._session is None or self._session.closed:
+            self._owns_session = True
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=64, limit_per_host=4, ttl_dns_cache=300),
+            )
+        return self._session
+
+    def _load_digest_cache(self) -> Dict[str, Dict[str, Any]]:
+        if not self.digest_cache_path or not self.digest_cache_path.exists():
+            return {}
+        try:
+            with open(self.digest_cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            self.log.warning("Ignoring unreadable digest cache %s: %s", self.digest_cache_path, e)
+            return {}
+
+    def _save_digest_cache(self):
+        if not self.digest_cache_path:
+            return
+        cache = {f"{c.host}:{c.port}": c.digest_state() for c in self.clients}
+        cache = {k: v for k, v in cache.items() if v}
+        try:
+            self.digest_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.digest_cache_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        except Exception as e:
+            self.log.warning("Failed to write digest cache %s: %s", self.digest_cache_path, e)
 
     async def auto_configure_terminals(self, callback_base_url: str):
         callback_path = self.cfg.get("isapi", {}).get("webhook_path", "/isapi/webhook")
         callback_url = f"{callback_base_url.rstrip('/')}{callback_path}"
         event_types = self.cfg.get("isapi", {}).get("event_types", ["accessControllerEvent"])
+        digest_cache = self._load_digest_cache()
+        session = await self._get_session()
+
+        # Terminals are independent: configure them concurrently, but politely bounded
+        sem = asyncio.Semaphore(self.CONFIGURE_CONCURRENCY)
+        tasks = [
+            self._configure_one(term, callback_url, event_types, session, digest_cache, sem)
+            for obj in self.cfg.get("objects", [])
+            for term in obj.get("terminals", [])
+        ]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for res in results:
+            if isinstance(res, Exception):
+                self.log.error("Terminal auto configure failed: %s", res)
+
+        self._save_digest_cache()
 
-        for obj in self.cfg.get("objects", []):
-            for term in obj.get("terminals", []):
-                host = term.get("ip") or term.get("host")
-                port = term.get("port", 80)
-                username = term.get("username", "admin")
-                password = term.get("password", "")
+    async def _configure_one(
+        self,
+        term: Dict[str, Any],
+        callback_url: str,
+        event_types: List[str],
+        session: aiohttp.ClientSession,
+        digest_cache: Dict[str, Dict[str, Any]],
+        sem: asyncio.Semaphore,
+    ):
+        host = term.get("ip") or term.get("host")
+        port = term.get("port", 80)
+        username = term.get("username", "admin")
+        password = term.get("password", "")
 
-                client = ISAPIDeviceClient(host, port, username, password, self.log)
-                self.clients.append(client)
+        client = ISAPIDeviceClient(host, port, username, password, self.log, session=session)
+        client.load_digest_state(digest_cache.get(f"{client.host}:{client.port}"))
+        self.clients.append(client)
 
-                if not await client.is_reachable():
-                    self.log.warning("Device %s is not reachable, skip auto configure", host)
-                    continue
+        async with sem:
+            if not await client.is_reachable():
+                self.log.warning("Device %s is not reachable, skip auto configure", host)
+                return
 
-                await client.configure_http_host(callback_url)
-                await client.enable_events(event_types)
+            # Independent PUTs: run them side by side on the client's pooled session.
+            # is_reachable() above has primed the Digest challenge, so both go out pre-signed.
+            await asyncio.gather(
+                client.configure_http_host(callback_url),
+                client.enable_events(event_types),
+            )
 
     async def close(self):
         for c in self.clients:
             await c.close()
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
@@ -12,86 +12,165 @@ Key behaviors for Hikvision ISAPI inbound notifications:
   to avoid device retry loops.
 
 This server:
-- Robustly parses multipart with tolerant header separators (\r\n\r\n OR \n\n)
+- Robustly parses multipart incrementally as the body streams in,
+  with tolerant header separators (\r\n\r\n OR \n\n)
 - Detects XML by part name/disposition OR payload sniffing
 - Falls back to scanning raw body for <EventNotificationAlert> ... </EventNotificationAlert>
 - Caches last XML per client IP for correlating image-only frames
 """
 
+import asyncio
+import hmac
 import logging
+import re
+import sys
 import time
 from dataclasses import dataclass
-from typing import Dict, Optional, List, Tuple, Any
+from functools import lru_cache
+from typing import Dict, Optional, List, Tuple, Any, Union
 
 from aiohttp import web
 
 from isapi.isapi_client import ISAPIEventParser, ISAPIEvent
+from utils.json_codec import dumps as _dumps
+
+
+_MAX_XML_SCAN = 1 << 20
+_STREAM_CHUNK_SIZE = 1 << 16
+_XML_OPEN_TAG = b"<EventNotificationAlert"
+_XML_CLOSE_TAG = b"</EventNotificationAlert>"
+_XML_PART_NAME_RE = re.compile(r"event|notification|alert|metadata|xml")
+_IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp")
+_NON_WS_RE = re.compile(rb"\S")
+
+
+# ============================================================================
+# Preallocated response bodies
+# ============================================================================
+#
+# aiohttp needs a fresh Response per request, but the bodies are constant:
+# serialize them once instead of re-encoding / json.dumps on every heartbeat.
+
+_OK_BODY = b"OK"
+_SUCCESS_BODY = _dumps({"status": "success"})
+_ACCEPTED_BODY = _dumps({"status": "accepted"})
+_PARSE_ERROR_BODY = _dumps({"status": "parse_error"})
+_UNAUTHORIZED_BODY = _dumps({"status": "unauthorized"})
+_TOO_MANY_BODY = _dumps({"status": "too_many_requests"})
+_HEALTH_OK_BODY = _dumps({"status": "ok"})
+_PAYLOAD_TOO_LARGE_BODY = _dumps({"status": "payload_too_large"})
+_UNSUPPORTED_BODY = _dumps({"status": "error", "message": "unsupported content type"})
+
+
+def _ok() -> web.Response:
+    return web.Response(status=200, body=_OK_BODY, content_type="text/plain", charset="utf-8")
+
+
+def _json(body: bytes, status: int) -> web.Response:
+    return web.Response(status=status, body=body, content_type="application/json", charset="utf-8")
 
 
 # ============================================================================
 # Helpers: headers parsing
 # ============================================================================
 
-def _parse_content_type_header(value: str) -> Tuple[str, Dict[str, str]]:
+# Devices resend byte-identical header values, so the parsers below are memoized.
+# They return immutable tuples of (key, value) pairs; callers dict() them as needed.
+_HeaderParams = Tuple[Tuple[str, str], ...]
+
+
+@lru_cache(maxsize=256)
+def _parse_content_type_header(value: str) -> Tuple[str, _HeaderParams]:
     """
     Parse Content-Type header into (mime, params).
-    Example: 'multipart/form-data; boundary=abc' -> ('multipart/form-data', {'boundary': 'abc'})
+    Example: 'multipart/form-data; boundary=abc' -> ('multipart/form-data', (('boundary', 'abc'),))
     """
     if not value:
-        return "", {}
+        return "", ()
     parts = [p.strip() for p in value.split(";") if p.strip()]
     mime = parts[0].lower() if parts else ""
-    params: Dict[str, str] = {}
+    params: List[Tuple[str, str]] = []
     for p in parts[1:]:
         if "=" in p:
             k, v = p.split("=", 1)
-            params[k.strip().lower()] = v.strip().strip('"')
-    return mime, params
+            params.append((k.strip().lower(), v.strip().strip('"')))
+    return mime, tuple(params)
+
 
+_KIND_MULTIPART = "multipart"
+_KIND_XML = "xml"
 
-def _parse_content_disposition(value: str) -> Dict[str, str]:
+# Exact MIME strings devices actually send -> handler kind (no lower()/substring scans)
+_MIME_KINDS: Dict[str, str] = {
+    "multipart/form-data": _KIND_MULTIPART,
+    "multipart/mixed": _KIND_MULTIPART,
+    "application/xml": _KIND_XML,
+    "text/xml": _KIND_XML,
+}
+
+
+def _classify_mime(mime: str) -> Optional[str]:
+    """
+    Map a bare MIME type to _KIND_MULTIPART / _KIND_XML / None.
+    Known spellings hit the dict; anything else takes the tolerant slow path.
+    """
+    kind = _MIME_KINDS.get(mime)
+    if kind is not None or not mime:
+        return kind
+    lowered = mime.lower()
+    if lowered.startswith("multipart/"):
+        return _KIND_MULTIPART
+    if "xml" in lowered:
+        return _KIND_XML
+    return None
+
+
+@lru_cache(maxsize=256)
+def _parse_content_disposition(value: bytes) -> _HeaderParams:
     """
-    Parse Content-Disposition:
+    Parse raw Content-Disposition bytes:
       form-data; name="EventNotificationAlert"; filename="img.jpg"
-    Returns dict keys lowercased.
+    Returns (key, value) pairs, keys lowercased; only parameter values are decoded.
     """
     if not value:
-        return {}
-    out: Dict[str, str] = {}
-    parts = [p.strip() for p in value.split(";") if p.strip()]
+        return ()
+    out: List[Tuple[str, str]] = []
+    parts = [p.strip() for p in value.split(b";") if p.strip()]
     for p in parts[1:]:
-        if "=" in p:
-            k, v = p.split("=", 1)
-            out[k.strip().lower()] = v.strip().strip('"')
-    return out
+        k, sep, v = p.partition(b"=")
+        if sep:
+            out.append(
+                (
+                    k.strip().lower().decode("ascii", errors="replace"),
+                    v.strip().strip(b'"').decode("utf-8", errors="replace"),
+                )
+            )
+    return tuple(out)
 
 
-def _strip_leading_noise(data: bytes) -> bytes:
-    """
-    Hikvision sometimes prefixes XML with NULs/BOM/whitespace.
-    We strip common leading control bytes (safe for XML detection only).
-    """
-    if not data:
-        return b""
-    s = data
-    s = s.lstrip(b"\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f \t\r\n")
-    if s.startswith(b"\xef\xbb\xbf"):
-        s = s[3:].lstrip()
-    return s
+# One anchored pass over the head of the payload:
+#   leading NULs/control bytes/whitespace (Hikvision noise), optional UTF-8 BOM,
+#   then an XML declaration, <EventNotificationAlert or any element start tag.
+_XML_HEAD_RE = re.compile(
+    rb"[\x00-\x0f ]*(?:\xef\xbb\xbf\s*)?<(?:\?xml|EventNotificationAlert|[A-Za-z_][\w.:-]*[\s/>])"
+)
+_XML_SNIFF_LIMIT = 8192
+_XML_PREFIXES = (b"<?xml", _XML_OPEN_TAG)
+_IMAGE_MAGIC = (b"\xff\xd8\xff", b"\x89PNG", b"BM")
 
 
 def _looks_like_xml(data: bytes) -> bool:
     if not data:
         return False
-    s = _strip_leading_noise(data)
-    if not s:
+    # Common cases first: a clean XML head, or image bytes that never need the 8 KiB scan
+    if data.startswith(_XML_PREFIXES):
+        return True
+    if data.startswith(_IMAGE_MAGIC):
         return False
-    return (
-        s.startswith(b"<?xml")
-        or s.startswith(b"<EventNotificationAlert")
-        or b"<EventNotificationAlert" in s[:8192]
-        or (s.startswith(b"<") and b"</" in s[:8192])
-    )
+    if _XML_HEAD_RE.match(data, 0, _XML_SNIFF_LIMIT):
+        return True
+    # Alert preceded by junk (e.g. raw multipart without boundary)
+    return data.find(_XML_OPEN_TAG, 0, _XML_SNIFF_LIMIT) != -1
 
 
 def _guess_filename(cd_params: Dict[str, str], fallback: str = "blob.bin") -> str:
@@ -106,101 +185,225 @@ def _guess_filename(cd_params: Dict[str, str], fallback: str = "blob.bin") -> st
 # Robust multipart parser (tolerant)
 # ============================================================================
 
-def _robust_parse_multipart_formdata(body: bytes, boundary: str) -> List[Tuple[Dict[str, str], bytes]]:
-    """
-    Very tolerant multipart/form-data parser.
+_Part = Tuple[Dict[bytes, bytes], bytes]
 
-    Returns list of (headers, payload)
-      - headers keys are lowercased
-      - payload is raw bytes (without trailing CRLF)
-    Supports:
-      - header separator: \r\n\r\n OR \n\n
-      - header lines: \r\n OR \n
+
+def _parse_part(data: Union[bytes, bytearray], start: int = 0, end: Optional[int] = None) -> Optional[_Part]:
     """
-    if not boundary or not body:
-        return []
+    Parse one delimiter-to-delimiter chunk data[start:end] into (headers, payload).
+    Works on offsets into the caller's buffer: only the header blob and the final
+    payload are copied out.
+    Returns None for preamble/closing marker, header-less or empty-payload chunks.
+    """
+    if end is None:
+        end = len(data)
+    if start >= end:
+        return None
 
-    bnd = boundary.encode("utf-8", errors="ignore")
-    delim = b"--" + bnd
+    # Closing marker or preamble can start with '--'
+    if data.startswith(b"--", start, end):
+        return None
 
-    chunks = body.split(delim)
-    parts: List[Tuple[Dict[str, str], bytes]] = []
+    # Strip leading newlines
+    if data.startswith(b"\r\n", start, end):
+        start += 2
+    elif data.startswith(b"\n", start, end):
+        start += 1
+
+    # Find end of headers
+    header_end = data.find(b"\r\n\r\n", start, end)
+    sep_len = 4
+    if header_end == -1:
+        header_end = data.find(b"\n\n", start, end)
+        sep_len = 2
+    if header_end == -1:
+        # No headers => heartbeat/empty frame or malformed; ignore
+        return None
 
-    for chunk in chunks:
-        if not chunk:
-            continue
+    payload_start = header_end + sep_len
+    payload_end = end
 
-        # Closing marker or preamble can start with '--'
-        if chunk.startswith(b"--"):
-            continue
+    # Strip one trailing CRLF/LF that precedes boundary
+    if data.endswith(b"\r\n", payload_start, payload_end):
+        payload_end -= 2
+    elif data.endswith(b"\n", payload_start, payload_end):
+        payload_end -= 1
+
+    # Empty/whitespace-only payload parts are heartbeat frames
+    if not _NON_WS_RE.search(data, payload_start, payload_end):
+        return None
 
-        # Strip leading newlines
-        if chunk.startswith(b"\r\n"):
-            chunk = chunk[2:]
-        elif chunk.startswith(b"\n"):
-            chunk = chunk[1:]
-
-        # Find end of headers
-        header_end = chunk.find(b"\r\n\r\n")
-        sep_len = 4
-        if header_end == -1:
-            header_end = chunk.find(b"\n\n")
-            sep_len = 2
-        if header_end == -1:
-            # No headers => heartbeat/empty frame or malformed; ignore
+    headers: Dict[bytes, bytes] = {}
+    for line in bytes(data[start:header_end]).replace(b"\r\n", b"\n").split(b"\n"):
+        k, sep, v = line.partition(b":")
+        if not sep:
             continue
+        headers[k.strip().lower()] = v.strip()
 
-        header_blob = chunk[:header_end].decode("utf-8", errors="replace")
-        payload = chunk[header_end + sep_len:]
+    return headers, bytes(data[payload_start:payload_end])
 
-        # Strip one trailing CRLF/LF that precedes boundary
-        if payload.endswith(b"\r\n"):
-            payload = payload[:-2]
-        elif payload.endswith(b"\n"):
-            payload = payload[:-1]
 
-        headers: Dict[str, str] = {}
-        for line in header_blob.replace("\r\n", "\n").split("\n"):
-            if ":" not in line:
-                continue
-            k, v = line.split(":", 1)
-            headers[k.strip().lower()] = v.strip()
+@lru_cache(maxsize=64)
+def _boundary_delimiter(boundary: str) -> bytes:
+    """
+    Encoded b"--" + boundary, built once per boundary string (devices reuse theirs).
+    """
+    return b"--" + boundary.encode("utf-8", errors="ignore")
 
-        parts.append((headers, payload))
 
-    # Filter out empty payload parts (heartbeat frames)
-    parts = [(h, p) for (h, p) in parts if p and p.strip()]
-    return parts
+class _MultipartPushParser:
+    """
+    Incremental (push) version of the tolerant multipart/form-data parser.
+
+    feed() accepts body chunks as they arrive from the socket and returns parts
+    completed so far; close() flushes the tail. Only the part currently in flight
+    is buffered, and the delimiter search resumes where the previous one stopped.
+    Chunking is identical to body.split(b"--" + boundary).
+    """
 
+    def __init__(self, boundary: str):
+        self._delim = _boundary_delimiter(boundary)
+        self._buf = bytearray()
+        self._scan_from = 0
+
+    def feed(self, data: bytes) -> List[_Part]:
+        self._buf += data
+        parts: List[_Part] = []
+        delim = self._delim
+        while True:
+            idx = self._buf.find(delim, self._scan_from)
+            if idx == -1:
+                # The delimiter may straddle the next chunk
+                self._scan_from = max(0, len(self._buf) - len(delim) + 1)
+                return parts
+            part = _parse_part(self._buf, 0, idx)
+            del self._buf[: idx + len(delim)]
+            self._scan_from = 0
+            if part:
+                parts.append(part)
+
+    def close(self) -> List[_Part]:
+        part = _parse_part(self._buf)
+        self._buf.clear()
+        self._scan_from = 0
+        return [part] if part else []
+
+
+def _robust_parse_multipart_formdata(body: bytes, boundary: str) -> List[_Part]:
+    """
+    Very tolerant multipart/form-data parser (whole-body convenience wrapper).
 
-def _extract_xml_from_raw_body(body: bytes) -> Optional[str]:
+    Returns list of (headers, payload)
+      - headers are raw bytes (ASCII per RFC 7578), keys lowercased
+      - payload is raw bytes (without trailing CRLF)
+    Supports:
+      - header separator: \r\n\r\n OR \n\n
+      - header lines: \r\n OR \n
+    """
+    if not boundary or not body:
+        return []
+
+    # Index walk over the body (same chunking as body.split(delim), without the copies)
+    delim = _boundary_delimiter(boundary)
+    parts: List[_Part] = []
+    pos = 0
+    while True:
+        nxt = body.find(delim, pos)
+        part = _parse_part(body, pos, len(body) if nxt == -1 else nxt)
+        if part:
+            parts.append(part)
+        if nxt == -1:
+            return parts
+        pos = nxt + len(delim)
+
+
+def _extract_xml_from_raw_body(body: bytes) -> Optional[bytes]:
     """
     Fallback: scan raw body for <EventNotificationAlert ... </EventNotificationAlert>.
     Handles NUL bytes by removing them for scanning only (does not damage binary payload usage elsewhere).
+    Only the first _MAX_XML_SCAN bytes are searched, and the NUL-stripped copy is made
+    only when the plain search misses, so large image bodies are not copied.
     """
     if not body:
         return None
     try:
-        scan = body.replace(b"\x00", b"")
-        start = scan.find(b"<EventNotificationAlert")
+        window = body[:_MAX_XML_SCAN] if len(body) > _MAX_XML_SCAN else body
+        start = window.find(_XML_OPEN_TAG)
         if start == -1:
-            return None
-        end = scan.find(b"</EventNotificationAlert>", start)
+            if b"\x00" not in window:
+                return None
+            window = window.replace(b"\x00", b"")
+            start = window.find(_XML_OPEN_TAG)
+            if start == -1:
+                return None
+        end = window.find(_XML_CLOSE_TAG, start)
         if end == -1:
             return None
-        end = end + len(b"</EventNotificationAlert>")
-        return scan[start:end].decode("utf-8", errors="replace")
+        end = end + len(_XML_CLOSE_TAG)
+        xml = window[start:end]
+        if b"\x00" in xml:
+            xml = xml.replace(b"\x00", b"")
+        return xml
     except Exception:
         return None
 
 
+# ============================================================================
+# Per-request part classification
+# ============================================================================
+
+class _MultipartCollector:
+    """
+    Classifies multipart parts as they come off the parser: keeps the event XML and
+    only the name and size of each image (nothing reads image contents), so the part
+    bytes are released right away instead of held until the request ends.
+    """
+    def __init__(self):
+        self.parts_seen = 0
+        self.xml_data: Optional[bytes] = None
+        self.images: Dict[str, int] = {}
+
+    def add(self, headers: Dict[bytes, bytes], payload: bytes):
+        """
+        payload comes from _parse_part, which already drops empty/whitespace-only parts.
+        """
+        self.parts_seen += 1
+        ct = (headers.get(b"content-type") or b"").lower()
+
+        # XML by explicit content-type
+        if b"xml" in ct:
+            self.xml_data = payload
+            return
+
+        cd = headers.get(b"content-disposition") or b""
+        cd_params = dict(_parse_content_disposition(cd))
+
+        # Declared images skip XML sniffing unless the part name hints at an event
+        if ct.startswith(b"image/") and not _XML_PART_NAME_RE.search((cd_params.get("name") or "").lower()):
+            self._add_image(_guess_filename(cd_params, "blob.bin"), payload)
+            return
+
+        # XML by payload sniffing (covers the name-hinted case as well)
+        if _looks_like_xml(payload):
+            self.xml_data = payload
+            return
+
+        # Images by content-type or filename hint
+        filename = _guess_filename(cd_params, "blob.bin")
+        if ct.startswith(b"image/") or filename.lower().endswith(_IMAGE_SUFFIXES):
+            self._add_image(filename, payload)
+
+    def _add_image(self, filename: str, payload: bytes):
+        self.images[filename] = len(payload)
+
+
 # ============================================================================
 # Correlation cache for image-only frames
 # ============================================================================
 
 @dataclass
 class _LastEventCacheItem:
-    xml: str
+    xml: bytes
     ts: float
 
 
@@ -213,10 +416,10 @@ class _LastEventCache:
         self._ttl = ttl_seconds
         self._items: Dict[str, _LastEventCacheItem] = {}
 
-    def set(self, client_ip: str, xml: str):
+    def set(self, client_ip: str, xml: bytes):
         self._items[client_ip] = _LastEventCacheItem(xml=xml, ts=time.time())
 
-    def get(self, client_ip: str) -> Optional[str]:
+    def get(self, client_ip: str) -> Optional[bytes]:
         item = self._items.get(client_ip)
         if not item:
             return None
@@ -239,6 +442,10 @@ class _LastEventCache:
 class ISAPIWebhookHandler:
     """
     Handles Hikvision ISAPI inbound POST notifications.
+
+    Once started, parsed events are queued and the device gets its 200 right away;
+    a background worker hands them to the processor in batches (up to batch_size
+    events or batch_window seconds). Without start() events are processed inline.
     """
 
     def __init__(
@@ -247,45 +454,148 @@ class ISAPIWebhookHandler:
         secret_token: Optional[str] = None,
         logger: Optional[logging.Logger] = None,
         cache_ttl_seconds: int = 30,
+        queue_size: int = 10000,
+        batch_size: int = 128,
+        batch_window: float = 0.02,
+        max_body: int = 16 << 20,
     ):
         self.processor = processor
         self.secret_token = secret_token
+        self._secret_token_bytes = (secret_token or "").encode("utf-8")
         self.log = logger or logging.getLogger("isapi.webhook")
         self.xml_parser = ISAPIEventParser(self.log)
         self.last_xml_cache = _LastEventCache(ttl_seconds=cache_ttl_seconds)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_body = max_body
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._worker:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker = asyncio.create_task(self._drain_queue())
+
+    async def stop(self, timeout: float = 10.0):
+        if not self._worker or not self._queue:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Devices already got 200 for these: the worker stores its in-flight batch when
+        # cancelled, and whatever is still queued is stored here for the pending retry
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        leftover: List[Tuple[ISAPIEvent, str]] = []
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait())
+        if leftover:
+            self.log.warning("Saving %d queued ISAPI events to storage on shutdown", len(leftover))
+            try:
+                await self.processor.save_isapi_events(leftover)
+            except Exception as e:  # pragma: no cover - defensive
+                self.log.error("Failed to save queued ISAPI events: %s", e)
+        self._worker = None
+        self._queue = None
+
+    async def _next_batch(self, batch: List[Tuple[ISAPIEvent, str]]):
+        """
+        Fill batch in place (the caller still holds what was taken if this is cancelled).
+        """
+        queue = self._queue
+        batch.append(await queue.get())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _drain_queue(self):
+        while True:
+            batch: List[Tuple[ISAPIEvent, str]] = []
+            try:
+                await self._next_batch(batch)
+                await self.processor.process_isapi_events(batch)
+            except asyncio.CancelledError:
+                # Shutdown timed out: the batch in flight goes to storage, not nowhere
+                if batch:
+                    self.log.warning("Saving %d in-flight ISAPI events to storage on shutdown", len(batch))
+                    try:
+                        await self.processor.save_isapi_events(batch)
+                    except Exception as e:  # pragma: no cover - defensive
+                        self.log.error("Failed to save in-flight ISAPI events: %s", e)
+                raise
+            except Exception as e:
+                self.log.exception("Processor failed for batch of %d ISAPI events: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
 
     async def handle(self, request: web.Request) -> web.StreamResponse:
         client_ip = request.remote or "unknown"
-        content_type_raw = request.headers.get("Content-Type", "")
-        mime, params = _parse_content_type_header(content_type_raw)
+        headers = request.headers  # CIMultiDictProxy: look each header up once
 
         # Optional shared-secret header (not Digest; webhook is inbound)
         if self.secret_token:
-            if request.headers.get("X-Webhook-Secret") != self.secret_token:
+            provided = headers.getone("X-Webhook-Secret", "").encode("utf-8", errors="replace")
+            if not hmac.compare_digest(provided, self._secret_token_bytes):
                 self.log.warning("Unauthorized webhook request from %s", client_ip)
-                return web.json_response({"status": "unauthorized"}, status=401)
+                return _json(_UNAUTHORIZED_BODY, status=401)
+
+        # Heartbeat fast path: nothing to read (Content-Length: 0 / no body at all)
+        content_length = request.content_length  # header lookup + int() on every access
+        if content_length == 0 or not request.can_read_body:
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug("Heartbeat/empty request from %s", client_ip)
+            return _ok()
+
+        # Size cap before anything is buffered (chunked bodies are capped while streaming)
+        if content_length is not None and content_length > self.max_body:
+            self.log.warning("Webhook body too large from %s (%d bytes)", client_ip, content_length)
+            return _json(_PAYLOAD_TOO_LARGE_BODY, status=413)
+
+        content_type_raw = headers.getone("Content-Type", "")
+        kind = _classify_mime(content_type_raw.partition(";")[0].strip())
+        boundary = ""
+        if kind is _KIND_MULTIPART:
+            # Parameters are only needed for the multipart boundary
+            boundary = dict(_parse_content_type_header(content_type_raw)[1]).get("boundary", "")
+
+        # Multipart with a boundary is parsed as it streams in (no full-body buffer)
+        if kind is _KIND_MULTIPART and boundary:
+            return await self._handle_multipart_stream(request, boundary, client_ip)
 
         # Read request body (POST per event is common; some firmwares keep-alive with empty body)
         body = await request.read()
-        if not body or not body.strip():
+        # First non-whitespace byte search: no stripped copy of a large body
+        if not _NON_WS_RE.search(body):
             # Heartbeat / empty frame
-            self.log.debug("Heartbeat/empty request from %s", client_ip)
-            return web.Response(status=200, text="OK")
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug("Heartbeat/empty request from %s", client_ip)
+            return _ok()
 
-        if mime.startswith("multipart/"):
-            boundary = params.get("boundary", "")
+        if kind is _KIND_MULTIPART:
             return await self._handle_multipart_bytes(body, boundary, client_ip)
 
         # Non-multipart: sometimes device sends pure XML
-        if ("xml" in mime) or _looks_like_xml(body):
-            xml_text = body.decode("utf-8", errors="replace").strip()
-            if not xml_text:
-                self.log.debug("Empty XML (heartbeat) from %s", client_ip)
-                return web.Response(status=200, text="OK")
-            return await self._process_event(xml_text, images=None, client_ip=client_ip)
+        if kind is _KIND_XML or _looks_like_xml(body):
+            return await self._process_event(body, images=None, client_ip=client_ip)
 
         self.log.debug("Unsupported content type '%s' from %s", content_type_raw, client_ip)
-        return web.json_response({"status": "error", "message": "unsupported content type"}, status=400)
+        return _json(_UNSUPPORTED_BODY, status=400)
 
     async def _handle_multipart_bytes(self, body: bytes, boundary: str, client_ip: str) -> web.StreamResponse:
         """
@@ -297,52 +607,54 @@ class ISAPIWebhookHandler:
             if xml_fallback:
                 return await self._process_event(xml_fallback, images=None, client_ip=client_ip)
             self.log.debug("Multipart without boundary treated as heartbeat from %s", client_ip)
-            return web.Response(status=200, text="OK")
+            return _ok()
 
-        parts = _robust_parse_multipart_formdata(body, boundary)
+        collector = _MultipartCollector()
+        for headers, payload in _robust_parse_multipart_formdata(body, boundary):
+            collector.add(headers, payload)
+        return await self._handle_parts(collector, body, client_ip)
 
+    async def _handle_multipart_stream(self, request: web.Request, boundary: str, client_ip: str) -> web.StreamResponse:
+        """
+        Feed the request body into _MultipartPushParser chunk by chunk and classify
+        each part as soon as it completes.
+        Only the first _MAX_XML_SCAN bytes are retained for the raw XML fallback.
+        """
+        parser = _MultipartPushParser(boundary)
+        collector = _MultipartCollector()
+        head = bytearray()
+        received = 0
+
+        async for chunk in request.content.iter_chunked(_STREAM_CHUNK_SIZE):
+            received += len(chunk)
+            if received > self.max_body:
+                self.log.warning("Webhook body too large from %s (over %d bytes)", client_ip, self.max_body)
+                return _json(_PAYLOAD_TOO_LARGE_BODY, status=413)
+            if len(head) < _MAX_XML_SCAN:
+                head += chunk[: _MAX_XML_SCAN - len(head)]
+            for headers, payload in parser.feed(chunk):
+                collector.add(headers, payload)
+        for headers, payload in parser.close():
+            collector.add(headers, payload)
+
+        return await self._handle_parts(collector, bytes(head), client_ip)
+
+    async def _handle_parts(self, collector: _MultipartCollector, raw_head: bytes, client_ip: str) -> web.StreamResponse:
+        """
+        Process the classified event XML / images.
+        raw_head is the (possibly truncated) raw body used for the XML fallback scan.
+        """
         # Heartbeat: boundary-only or empty parts
-        if not parts:
+        if not collector.parts_seen:
             self.log.debug("Empty multipart (heartbeat) from %s", client_ip)
-            return web.Response(status=200, text="OK")
-
-        xml_data: Optional[str] = None
-        images: Dict[str, bytes] = {}
-
-        for headers, payload in parts:
-            ct = (headers.get("content-type") or "").lower()
-            cd = headers.get("content-disposition") or ""
-            cd_params = _parse_content_disposition(cd)
-            part_name = (cd_params.get("name") or "").lower()
-            filename = _guess_filename(cd_params, "blob.bin")
-
-            # XML by explicit content-type
-            if "xml" in ct or ct in ("text/xml", "application/xml"):
-                if payload and payload.strip():
-                    xml_data = payload.decode("utf-8", errors="replace")
-                    continue
-
-            # XML by name hint + sniffing
-            if payload and payload.strip():
-                if any(x in part_name for x in ("event", "notification", "alert", "metadata", "xml")):
-                    if _looks_like_xml(payload):
-                        xml_data = payload.decode("utf-8", errors="replace")
-                        continue
-
-            # XML by payload sniffing
-            if payload and payload.strip() and _looks_like_xml(payload):
-                xml_data = payload.decode("utf-8", errors="replace")
-                continue
+            return _ok()
 
-            # Images by content-type or filename hint
-            if payload and payload.strip():
-                if ct.startswith("image/") or filename.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")):
-                    images[filename] = payload
-                    continue
+        xml_data = collector.xml_data
+        images = collector.images
 
         # If still no XML, try raw fallback scan
         if not xml_data:
-            xml_data = _extract_xml_from_raw_body(body)
+            xml_data = _extract_xml_from_raw_body(raw_head)
 
         # If we got XML, cache it (for correlating next image-only frame)
         if xml_data:
@@ -369,33 +681,45 @@ class ISAPIWebhookHandler:
                 client_ip,
                 len(images),
             )
-            return web.Response(status=200, text="OK")
+            return _ok()
 
         # Neither XML nor images -> heartbeat/empty multipart frame
         self.log.debug("Multipart contained no actionable parts from %s -> accepted", client_ip)
-        return web.Response(status=200, text="OK")
+        return _ok()
 
-    async def _process_event(self, xml_data: str, images: Optional[Dict[str, bytes]], client_ip: str) -> web.StreamResponse:
+    async def _process_event(self, xml_data: bytes, images: Optional[Dict[str, int]], client_ip: str) -> web.StreamResponse:
         event: Optional[ISAPIEvent] = self.xml_parser.parse(xml_data, images)
         if not event:
             # Body was non-empty but XML parse failed — warn, but avoid ERROR spam.
             self.log.warning("Failed to parse ISAPI XML from %s", client_ip)
-            return web.json_response({"status": "parse_error"}, status=400)
+            return _json(_PARSE_ERROR_BODY, status=400)
+
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait((event, client_ip))
+                return _json(_ACCEPTED_BODY, status=200)
+            except asyncio.QueueFull:
+                # Backpressure: process inline rather than drop the event
+                self.log.warning("ISAPI event queue full, processing inline for %s", client_ip)
 
         try:
-            ok = await self.processor.process_isapi_event(event.to_dict(), client_ip)
+            ok = await self.processor.process_isapi_event(event, client_ip)
         except Exception as e:
             self.log.exception("Processor failed for event from %s: %s", client_ip, e)
             # Still respond 200 to avoid device retry storms; your processor can requeue internally.
-            return web.json_response({"status": "accepted"}, status=200)
+            return _json(_ACCEPTED_BODY, status=200)
 
-        return web.json_response({"status": "success" if ok else "accepted"}, status=200)
+        return _json(_SUCCESS_BODY if ok else _ACCEPTED_BODY, status=200)
 
 
 # ============================================================================
 # ISAPI Webhook Server (aiohttp)
 # ============================================================================
 
+async def _health(_: web.Request) -> web.StreamResponse:
+    return _json(_HEALTH_OK_BODY, status=200)
+
+
 class ISAPIWebhookServer:
     def __init__(self, handler: ISAPIWebhookHandler, cfg: dict, logger: Optional[logging.Logger] = None):
         self.cfg = cfg.get("isapi", {}) if isinstance(cfg, dict) else {}
@@ -405,43 +729,108 @@ class ISAPIWebhookServer:
         self.log = logger or logging.getLogger("isapi.server")
         self.runner: Optional[web.AppRunner] = None
         self.site: Optional[web.TCPSite] = None
+        self.api_site: Optional[web.TCPSite] = None
+        # Local port of the health site; requests arriving there get /health and nothing else
+        self._health_port: Optional[int] = None
         self.app: Optional[web.Application] = None
+        self.max_inflight_per_ip = int(self.cfg.get("max_inflight_per_ip", 32))
+        # SO_REUSEPORT: several bridge processes can share the webhook port, the kernel spreads connections
+        self.reuse_port = bool(self.cfg.get("reuse_port", False))
+        # Listen queue depth: terminals reconnect in bursts after a network blip
+        self.backlog = int(self.cfg.get("backlog", 2048))
+        self._inflight: Dict[str, int] = {}
+
+    def _make_inflight_middleware(self):
+        """
+        Per-remote-IP in-flight request cap so one storming terminal cannot starve the loop.
+        Over the cap, empty bodies (heartbeats) get a fast 200 - devices retry on errors -
+        and anything else gets 429.
+        """
+        limit = self.max_inflight_per_ip
+        inflight = self._inflight
+
+        @web.middleware
+        async def inflight_middleware(request: web.Request, handler):
+            client_ip = request.remote or "unknown"
+            current = inflight.get(client_ip, 0)
+            if limit > 0 and current >= limit:
+                # Same emptiness test as handle(): a chunked upload has no Content-Length but is not a heartbeat
+                if request.content_length == 0 or not request.can_read_body:
+                    return _ok()
+                self.log.warning("Too many in-flight requests from %s (%d)", client_ip, current)
+                return _json(_TOO_MANY_BODY, status=429)
+
+            inflight[client_ip] = current + 1
+            try:
+                return await handler(request)
+            finally:
+                left = inflight.get(client_ip, 1) - 1
+                if left > 0:
+                    inflight[client_ip] = left
+                else:
+                    inflight.pop(client_ip, None)
+
+        return inflight_middleware
+
+    def _make_health_site_middleware(self):
+        """
+        The health site shares the webhook runner, so it would serve every webhook route too
+        (on whatever interfaces the health port binds). Requests that arrived on it only get /health.
+        """
+
+        @web.middleware
+        async def health_site_middleware(request: web.Request, handler):
+            port = self._health_port
+            if port is not None and request.path != "/health" and request.transport is not None:
+                sockname = request.transport.get_extra_info("sockname")
+                if sockname and sockname[1] == port:
+                    raise web.HTTPNotFound()
+            return await handler(request)
+
+        return health_site_middleware
 
     async def start(self):
-        self.app = web.Application()
+        await self.handler.start()
+        self.app = web.Application(
+            middlewares=[self._make_health_site_middleware(), self._make_inflight_middleware()],
+            client_max_size=self.handler.max_body,
+        )
         path = self.cfg.get("webhook_path", "/ISAPI/Event/notification/alert")
         self.app.router.add_post(path, self.handler.handle)
         # optional fallback:
         self.app.router.add_post("/", self.handler.handle)
+        self.app.router.add_get("/health", _health)
 
         self.runner = web.AppRunner(self.app)
         await self.runner.setup()
 
-        self.site = web.TCPSite(self.runner, self.host, self.port)
+        self.site = web.TCPSite(
+            self.runner, self.host, self.port, backlog=self.backlog, reuse_port=self.reuse_port or None
+        )
         await self.site.start()
 
         self.log.debug("ISAPI Webhook server started on %s:%s", self.host, self.port)
 
     async def stop(self):
         if self.runner:
+            # Stops the health site as well
             await self.runner.cleanup()
+        # Stop accepting first, then flush whatever is still queued
+        await self.handler.stop()
         self.log.info("ISAPI Webhook server stopped")
 
     async def start_api(self, host="0.0.0.0", port=8081):
         """
-        Minimal health endpoint.
+        Health endpoint: one more TCPSite on the webhook runner (no second app or runner),
+        restricted to /health by the health-site middleware. Call after start().
         """
-        api = web.Application()
-
-        async def health(_):
-            return web.json_response({"status": "ok"})
-
-        api.router.add_get("/health", health)
-
-        runner = web.AppRunner(api)
-        await runner.setup()
-        site = web.TCPSite(runner, host, port)
-        await site.start()
+        if port == self.port and host == self.host:
+            # /health is already served by the webhook site
+            return
+        if port != self.port:
+            self._health_port = port
+        self.api_site = web.TCPSite(self.runner, host, port, reuse_port=self.reuse_port or None)
+        await self.api_site.start()
         self.log.debug("Health endpoint started on %s:%s", host, port)
 
 
@@ -449,19 +838,52 @@ class ISAPIWebhookServer:
 # Optional: terminal manager (kept for compatibility)
 # ============================================================================
 
+def _normalize_mac(mac: Optional[str]) -> str:
+    """
+    Canonical MAC key: uppercase, no separators, interned
+    (AA:BB:CC:DD:EE:FF, aa-bb-cc-dd-ee-ff and AABBCCDDEEFF map to the same key).
+    """
+    if not mac:
+        return ""
+    return sys.intern(mac.upper().replace(":", "").replace("-", ""))
+
+
+_MISSING = object()
+
+
 class ISAPITerminalManager:
     def __init__(self, cfg: dict):
         self.terminals: List[Dict[str, Any]] = cfg.get("terminals", []) if isinstance(cfg, dict) else []
         self.tenant_map = self._map_by_mac()
+        self._mac_lookup = self._map_mac_aliases()
 
     def _map_by_mac(self) -> Dict[str, Optional[str]]:
         mapping: Dict[str, Optional[str]] = {}
         for t in self.terminals:
-            mac = (t.get("mac") or "").upper()
+            mac = _normalize_mac(t.get("mac"))
             tenant = t.get("tenant")
             if mac:
                 mapping[mac] = tenant
         return mapping
 
+    def _map_mac_aliases(self) -> Dict[str, Optional[str]]:
+        """
+        Spellings devices actually report (as configured, upper/lower, with or without
+        separators) -> tenant, so the common case is one dict hit with no allocation.
+        """
+        aliases: Dict[str, Optional[str]] = {}
+        for t in self.terminals:
+            raw = t.get("mac") or ""
+            canonical = _normalize_mac(raw)
+            if not canonical:
+                continue
+            tenant = self.tenant_map[canonical]
+            for alias in (raw, raw.upper(), raw.lower(), canonical, canonical.lower()):
+                aliases[sys.intern(alias)] = tenant
+        return aliases
+
     def get_tenant_by_mac(self, mac: str) -> Optional[str]:
-        return self.tenant_map.get((mac or "").upper())
+        tenant = self._mac_lookup.get(mac, _MISSING) if mac else None
+        if tenant is not _MISSING:
+            return tenant
+        return self.tenant_map.get(_normalize_mac(mac))
@@ -1,20 +1,43 @@
 import asyncio
 import logging
-from asyncio import IncompleteReadError
+from typing import Set
+
+_READ_CHUNK_SIZE = 64 * 1024
+_PACKET_QUEUE_SIZE = 64
 
 
 class ISUPTCPServer:
-    def __init__(self, host, port, processor, metrics, parser, logger: logging.Logger):
+    def __init__(
+        self,
+        host,
+        port,
+        processor,
+        metrics,
+        parser,
+        logger: logging.Logger,
+        reuse_port: bool = False,
+        backlog: int = 2048,
+    ):
         self.host = host
         self.port = port
+        # SO_REUSEPORT: several bridge processes can share the ISUP port, the kernel spreads connections
+        self.reuse_port = reuse_port
+        self.backlog = backlog
         self.processor = processor
         self.metrics = metrics
         self.parser = parser
         self.log = logger
         self.server: asyncio.AbstractServer | None = None
+        self._connections: Set[asyncio.Task] = set()
 
     async def start(self):
-        self.server = await asyncio.start_server(self._handle_client, host=self.host, port=self.port)
+        self.server = await asyncio.start_server(
+            self._on_connect,
+            host=self.host,
+            port=self.port,
+            backlog=self.backlog,
+            reuse_port=self.reuse_port or None,
+        )
         sockets = self.server.sockets or []
         for sock in sockets:
             self.log.debug("ISUP TCP listening on %s", sock.getsockname())
@@ -22,41 +45,143 @@ class ISUPTCPServer:
     async def stop(self):
         if self.server:
             self.server.close()
+            # Connection tasks save their acked-but-unprocessed packets to storage when cancelled
+            connections = set(self._connections)
+            for task in connections:
+                task.cancel()
+            if connections:
+                await asyncio.wait(connections)
             await self.server.wait_closed()
 
+    def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Plain callback: the connection task is ours, not the stream protocol's. On 3.11 the
+        protocol's done-callback logs a traceback for a handler task that ends cancelled,
+        and stop() cancels these tasks.
+        """
+        task = asyncio.get_running_loop().create_task(self._handle_client(reader, writer))
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+
     async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         peer = writer.get_extra_info("peername")
         peer_ip = peer[0] if isinstance(peer, tuple) else str(peer)
         self.metrics.connections_total += 1
         self.log.info("New ISUP connection from %s", peer_ip)
 
+        # Per-frame calls bound once for the receive loop
+        header_size = self.parser.HEADER_SIZE
+        parse_header = self.parser._parse_header  # type: ignore[attr-defined]
+        make_ack = self.parser.make_ack
+        heartbeat_ack = self.parser.make_heartbeat_ack()
+        write = writer.write
+        buf = bytearray()
+        # Packets are acked as soon as they are queued; processing runs behind a bounded
+        # queue so a slow downstream does not delay acks (a full queue throttles reads)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_PACKET_QUEUE_SIZE)
+        consumer = asyncio.create_task(self._process_packets(queue, peer_ip))
         try:
             while True:
-                header_bytes = await reader.readexactly(self.parser.HEADER_SIZE)
-                header = self.parser._parse_header(header_bytes)  # type: ignore[attr-defined]
-                if not header:
-                    self.log.warning("Invalid ISUP header from %s", peer_ip)
+                chunk = await reader.read(_READ_CHUNK_SIZE)
+                if not chunk:
+                    self.log.info("Connection from %s closed", peer_ip)
                     break
+                if buf:
+                    buf += chunk
+                else:
+                    buf = bytearray(chunk)
 
-                body = await reader.readexactly(header.data_length)
-                packet = header_bytes + body
-                await self.processor.process_isup_packet(packet, peer_ip)
+                # Handle every complete frame already buffered; packets are queued as
+                # memoryview slices (a buffer is never written again once sliced)
+                view = memoryview(buf)
+                offset = 0
+                invalid = False
+                while len(buf) - offset >= header_size:
+                    header = parse_header(view[offset : offset + header_size])
+                    if not header:
+                        self.log.warning("Invalid ISUP header from %s", peer_ip)
+                        invalid = True
+                        break
 
-                if header.data_length == 0:
-                    ack = self.parser.make_heartbeat_ack()
-                else:
-                    ack = self.parser.make_ack(header.sequence_number)
+                    frame_end = offset + header_size + header.data_length
+                    if frame_end > len(buf):
+                        break
+                    packet = view[offset:frame_end]
+                    offset = frame_end
+
+                    if header.data_length == 0:
+                        # Heartbeat: nothing to parse or forward, the ack is all it needs
+                        write(heartbeat_ack)
+                        continue
+                    # Queued before the ack: a frame cut off here was never acked, the terminal resends it
+                    await queue.put((packet, header))
+                    ack = make_ack(header.sequence_number)
+                    if ack:
+                        write(ack)
 
-                if ack:
-                    writer.write(ack)
-                    await writer.drain()
-        except IncompleteReadError:
-            self.log.info("Connection from %s closed", peer_ip)
+                view.release()
+                if offset:
+                    # Fresh buffer for the partial tail: slices handed out above may still be alive
+                    buf = buf[offset:]
+                await writer.drain()
+                if invalid:
+                    break
+        except asyncio.CancelledError:
+            # Server shutdown: the consumer stores what is left (in the finally below)
+            consumer.cancel()
+            raise
         except Exception as exc:  # pragma: no cover - defensive
             self.log.error("ISUP connection error from %s: %s", peer_ip, exc)
         finally:
             writer.close()
+            await self._finish_packets(queue, consumer)
             try:
                 await writer.wait_closed()
             except Exception:
                 pass
+
+    async def _finish_packets(self, queue: asyncio.Queue, consumer: asyncio.Task):
+        """
+        Let already acked packets finish processing. The end-of-stream marker is put from a
+        side task, so a full queue whose consumer is gone cannot block here; if this task is
+        cancelled (shutdown), the consumer is cancelled too and stores what it had not sent
+        before the cancellation goes on.
+        """
+        done_marker = asyncio.ensure_future(queue.put(None))
+        try:
+            await asyncio.wait({consumer})
+        except asyncio.CancelledError:
+            consumer.cancel()
+            await asyncio.wait({consumer})
+            raise
+        finally:
+            done_marker.cancel()
+
+    async def _process_packets(self, queue: asyncio.Queue, peer_ip: str):
+        item = None
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                packet, header = item
+                try:
+                    await self.processor.process_isup_packet(packet, peer_ip, header)
+                except Exception as exc:  # pragma: no cover - defensive
+                    self.log.error("ISUP packet processing failed for %s: %s", peer_ip, exc)
+                item = None
+        except asyncio.CancelledError:
+            # Acked packets must not vanish: the one in flight and everything still queued
+            # go to pending storage for the retry loop
+            unsent = [item] if item is not None else []
+            while not queue.empty():
+                queued = queue.get_nowait()
+                if queued is not None:
+                    unsent.append(queued)
+            if unsent:
+                self.log.warning("Saving %d unprocessed ISUP packets from %s to storage", len(unsent), peer_ip)
+                try:
+                    await self.processor.save_isup_packets(unsent, peer_ip)
+                except Exception as exc:  # pragma: no cover - defensive
+                    self.log.error("Failed to save unprocessed ISUP packets from %s: %s", peer_ip, exc)
+            raise
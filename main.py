@@ -1,24 +1,37 @@
 #!/usr/bin/env python3
 import asyncio
+import json
+import os
 import signal
+import tempfile
 from pathlib import Path
+from typing import Union
 
+import aiohttp
 import yaml
-from aiohttp import web
 
 from core.metrics import ServerMetrics
 from core.processor import EventProcessor
 from core.storage import EventStorage
 from core.tenant_manager import TenantManager
-from hikvision import HikvisionEventDispatcher, create_hikvision_listener  # noqa: F401
-from isapi.isapi_device_manager import ISAPIDeviceManager
 from isapi.isapi_server import ISAPITerminalManager, ISAPIWebhookHandler, ISAPIWebhookServer
 from isup.isup_protocol import ISUPv5Parser
 from isup.isup_server import ISUPTCPServer
-from utils.logging_setup import setup_logging
+from utils.logging_setup import setup_logging, stop_logging
 
-PROJECT_ROOT = Path(__file__).resolve().parent
-CONFIG_PATH = PROJECT_ROOT / "config" / "config.yaml"
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # pragma: no cover - PyYAML built without libyaml
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    import uvloop as _uvloop
+except ImportError:  # pragma: no cover - optional dependency
+    _uvloop = None
+
+# Plain strings: built once, passed straight to open()/os.stat()
+PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
+CONFIG_PATH = os.path.join(PROJECT_ROOT, "config", "config.yaml")
 
 
 class ServerConfig:
@@ -26,32 +39,87 @@ class ServerConfig:
         s = cfg.get("server", {})
         self.host = s.get("host", "0.0.0.0")
         self.port = s.get("port", 8001)
+        self.reuse_port = bool(s.get("reuse_port", False))
+        self.backlog = int(s.get("backlog", 2048))
         self.health_port = s.get("health_check_port", 8081)
         self.log_level = s.get("log_level", "INFO")
+        self.lean_log_records = bool(s.get("lean_log_records", False))
         self.storage_path = Path(s.get("storage_path", "./data/storage"))
         self.max_pending_days = s.get("max_pending_days", 30)
         self.isapi = cfg.get("isapi", {})
         self.features = cfg.get("features", {})
 
     @classmethod
-    def load(cls, path: Path):
-        with open(path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
+    def load(cls, path: Union[str, os.PathLike]):
+        data = _load_yaml_cached(path)
         return cls(data), data
 
 
-async def _periodic_pending(processor: EventProcessor, stop_event: asyncio.Event, interval: int = 30):
-    while not stop_event.is_set():
-        await processor.retry_pending_events()
+def _load_yaml_cached(path: Union[str, os.PathLike]) -> dict:
+    """
+    Parse a YAML config through a JSON sidecar (<name>.cache.json) keyed on the source
+    file's mtime and size; the YAML is only parsed again after it changes.
+    """
+    path = os.fspath(path)
+    st = os.stat(path)
+    if st.st_size == 0:
+        # Empty config: nothing to parse or cache
+        return {}
+    source_key = [st.st_mtime_ns, st.st_size]
+    cache_path = path + ".cache.json"
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["source"] == source_key:
+            return cached["data"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    # Binary stream: libyaml detects and decodes UTF-8 itself, no text-IO layer in between
+    with open(path, "rb") as f:
+        data = yaml.load(f, Loader=_YamlLoader) or {}
+    _write_config_cache(cache_path, source_key, data)
+    return data
+
+
+def _write_config_cache(cache_path: str, source_key: list, data) -> None:
+    try:
+        encoded = json.dumps({"source": source_key, "data": data}, ensure_ascii=False)
+        # Only cache configs JSON keeps intact (no dates, non-string keys, ...)
+        if json.loads(encoded)["data"] != data:
+            return
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(cache_path), prefix=os.path.basename(cache_path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(encoded)
+            os.replace(tmp, cache_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except (OSError, TypeError, ValueError):
+        # Read-only config directory or unserialisable data: run without the cache
+        pass
+
+
+async def _periodic_pending(processor: EventProcessor, stopped: asyncio.Future, interval: int = 30):
+    while not stopped.done():
+        try:
+            await processor.retry_pending_events()
+        except Exception as e:  # pragma: no cover - defensive
+            # A failed round (e.g. unreadable storage directory) must not end the retry loop
+            processor.log.error("Pending retry round failed: %s", e)
         try:
-            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+            # shield: a timeout must not cancel the shared shutdown future
+            await asyncio.wait_for(asyncio.shield(stopped), timeout=interval)
         except asyncio.TimeoutError:
             continue
 
 
 async def main():
     cfg, cfg_dict = ServerConfig.load(CONFIG_PATH)
-    logger = setup_logging(cfg.log_level)
+    logger = setup_logging(cfg.log_level, lean_records=cfg.lean_log_records)
     logger.debug("🚀 ISUP/ISAPI Bridge starting...")
 
     metrics = ServerMetrics()
@@ -59,6 +127,10 @@ async def main():
     tenant_mgr = TenantManager(cfg_dict)
     term_mgr = ISAPITerminalManager(cfg_dict)
     parser = ISUPv5Parser()
+    # One outbound connection pool for the process (1C API + terminal configuration)
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=200, ttl_dns_cache=300, keepalive_timeout=60)
+    )
 
     processor = EventProcessor(
         tenant_manager=tenant_mgr,
@@ -67,48 +139,79 @@ async def main():
         metrics=metrics,
         logger=logger,
         isup_parser=parser,
+        session=http_session,
     )
 
     tcp_server = ISUPTCPServer(
-        host=cfg.host, port=cfg.port, processor=processor, metrics=metrics, parser=parser, logger=logger
+        host=cfg.host,
+        port=cfg.port,
+        processor=processor,
+        metrics=metrics,
+        parser=parser,
+        logger=logger,
+        reuse_port=cfg.reuse_port,
+        backlog=cfg.backlog,
     )
 
-    isapi_handler = ISAPIWebhookHandler(processor, secret_token=cfg.isapi.get("webhook_secret"), logger=logger)
+    isapi_handler = ISAPIWebhookHandler(
+        processor,
+        secret_token=cfg.isapi.get("webhook_secret"),
+        logger=logger,
+        max_body=int(cfg.isapi.get("max_body", 16 << 20)),
+    )
     isapi_server = ISAPIWebhookServer(isapi_handler, cfg_dict, logger)
-    device_mgr = ISAPIDeviceManager(cfg_dict, logger)
+    device_mgr = None
 
-    await tcp_server.start()
-    await isapi_server.start()
+    # Listeners are independent: bind them in one wave
+    await asyncio.gather(tcp_server.start(), isapi_server.start())
     await isapi_server.start_api(host="0.0.0.0", port=cfg.health_port)
 
-    stop_event = asyncio.Event()
     loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
 
     def _stop():
         logger.info("Shutting down...")
-        stop_event.set()
+        if not stopped.done():
+            stopped.set_result(None)
 
     for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, _stop)
-
-    tasks = [asyncio.create_task(_periodic_pending(processor, stop_event))]
+        try:
+            loop.add_signal_handler(sig, _stop)
+        except NotImplementedError:
+            # Windows event loops: plain handler, hop back onto the loop thread
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(_stop))
 
+    pending_task = asyncio.create_task(_periodic_pending(processor, stopped), name="pending-retry")
     try:
         if cfg.features.get("auto_configure_terminals"):
-            base_url = cfg.isapi.get("webhook_base_url", f"http://{cfg.host}:8002")
+            # Only deployments that push the webhook config to terminals need the device manager
+            from isapi.isapi_device_manager import ISAPIDeviceManager
+
+            device_mgr = ISAPIDeviceManager(cfg_dict, logger, session=http_session)
+            base_url = cfg.isapi.get("webhook_base_url") or f"http://{cfg.host}:8002"
             await device_mgr.auto_configure_terminals(base_url)
 
-        await stop_event.wait()
+        await stopped
     finally:
-        for t in tasks:
-            t.cancel()
-        await asyncio.gather(*tasks, return_exceptions=True)
-        await tcp_server.stop()
-        await isapi_server.stop()
-        await storage.close()
-        await device_mgr.close()
+        # Don't wait for an in-progress retry round (1C backoff) to finish
+        pending_task.cancel()
+        await asyncio.gather(pending_task, return_exceptions=True)
+        # Listeners first (the webhook queue still flushes through the processor), then the
+        # processor's dependencies; closers within a phase run concurrently
+        closers = [tcp_server.stop(), isapi_server.stop()]
+        if device_mgr is not None:
+            closers.append(device_mgr.close())
+        for phase in (closers, [storage.close(), processor.close()], [http_session.close()]):
+            for res in await asyncio.gather(*phase, return_exceptions=True):
+                if isinstance(res, Exception):
+                    logger.error("Shutdown step failed: %s", res)
         logger.info("Stopped")
+        stop_logging()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if _uvloop is not None:
+        # libuv event loop: cheaper socket I/O for many small ISUP frames / webhook requests
+        _uvloop.run(main())
+    else:
+        asyncio.run(main())
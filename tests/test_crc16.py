@@ -0,0 +1,35 @@
+import pytest
+
+from isup import isup_protocol
+from isup.isup_protocol import ISUPv5Parser
+
+SAMPLES = [
+    b"",
+    b"123456789",
+    bytes(range(256)),
+    ISUPv5Parser().make_heartbeat_ack(),
+    ISUPv5Parser().make_ack(0xDEADBEEF),
+]
+
+
+def _table_crc16(data: bytes, monkeypatch) -> int:
+    monkeypatch.setattr(isup_protocol, "_fastcrc16", None)
+    return ISUPv5Parser()._crc16(data)
+
+
+def test_table_crc16_matches_modbus_check_value(monkeypatch):
+    # CRC-16/MODBUS check value from the CRC catalogue
+    assert _table_crc16(b"123456789", monkeypatch) == 0x4B37
+
+
+@pytest.mark.parametrize("data", SAMPLES)
+def test_fastcrc_matches_table(data, monkeypatch):
+    fastcrc16 = pytest.importorskip("fastcrc").crc16
+    assert fastcrc16.modbus(data) == _table_crc16(data, monkeypatch)
+
+
+def test_heartbeat_ack_crc_is_the_same_with_and_without_fastcrc(monkeypatch):
+    pytest.importorskip("fastcrc")
+    with_fastcrc = ISUPv5Parser().make_heartbeat_ack()
+    monkeypatch.setattr(isup_protocol, "_fastcrc16", None)
+    assert ISUPv5Parser().make_heartbeat_ack() == with_fastcrc
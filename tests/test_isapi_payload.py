@@ -0,0 +1,41 @@
+import pytest
+
+from core.processor import EventProcessor
+from isapi.isapi_client import ISAPIEvent
+
+
+def _event(ip_address="10.0.0.5"):
+    return ISAPIEvent(
+        event_type="AccessControllerEvent",
+        event_state="active",
+        device_id="DEV1",
+        mac_address="aa:bb:cc:dd:ee:ff",
+        ip_address=ip_address,
+        timestamp="2024-01-01T00:00:00+03:00",
+        card_number="12345",
+        employee_number="7",
+        door_id="1",
+        reader_id="1",
+        direction="in",
+        major_event_type="5",
+        minor_event_type="75",
+        success=True,
+        image_ids=["p1.jpg"],
+        raw_xml=b"<EventNotificationAlert/>",
+    )
+
+
+@pytest.mark.parametrize("peer_ip", ["192.168.1.20", "", None])
+def test_isapi_payload_keeps_wire_shape(peer_ip):
+    event = _event()
+    # What the processor sent before events were handed over as objects
+    expected = {"source": "ISAPI", **event.to_dict(), "ip": peer_ip}
+
+    payload = EventProcessor._isapi_payload(event, peer_ip)
+
+    assert list(payload.items()) == list(expected.items())
+
+
+def test_to_dict_keeps_device_ip_without_client_ip():
+    assert _event().to_dict()["ip"] == "10.0.0.5"
+    assert "source" not in _event().to_dict()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+from core.metrics import ServerMetrics
+from isup.isup_protocol import ISUPv5Parser
+from isup.isup_server import ISUPTCPServer
+
+ACCESS_BODY = bytes(range(26))
+
+
+def frame(seq: int, body: bytes = ACCESS_BODY) -> bytes:
+    return (
+        b"##\x01\x10"
+        + len(body).to_bytes(2, "big")
+        + b"DEV".ljust(16, b"\0")
+        + seq.to_bytes(4, "big")
+        + b"\0\0"
+        + body
+    )
+
+
+class FakeProcessor:
+    def __init__(self, block: bool = False):
+        self.processed = []
+        self.saved = []
+        self._block = block
+
+    async def process_isup_packet(self, raw, ip, header=None):
+        if self._block:
+            await asyncio.Event().wait()
+        self.processed.append(bytes(raw))
+
+    async def save_isup_packets(self, packets, ip):
+        self.saved.extend(bytes(packet) for packet, _ in packets)
+
+
+async def _start(processor):
+    server = ISUPTCPServer(
+        "127.0.0.1", 0, processor, ServerMetrics(), ISUPv5Parser(strict_mode=False), logging.getLogger("test")
+    )
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+    return server, port
+
+
+async def _exchange(pieces, expected_ack_len, processor=None):
+    """
+    Send the pieces one write at a time, read back expected_ack_len bytes, close the client
+    and stop the server. Returns (acks, processor).
+    """
+    processor = processor or FakeProcessor()
+    server, port = await _start(processor)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for piece in pieces:
+            writer.write(piece)
+            await writer.drain()
+            await asyncio.sleep(0)
+        acks = await asyncio.wait_for(reader.readexactly(expected_ack_len), 5)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+        await asyncio.sleep(0.05)
+        await server.stop()
+    return acks, processor
+
+
+def test_pipelined_frames_are_processed_in_order():
+    parser = ISUPv5Parser()
+    frames = [frame(seq) for seq in range(1, 6)]
+    expected_acks = b"".join(parser.make_ack(seq) for seq in range(1, 6))
+
+    acks, processor = asyncio.run(_exchange([b"".join(frames)], len(expected_acks)))
+
+    assert acks == expected_acks
+    assert processor.processed == frames
+
+
+def test_split_header_is_reassembled():
+    parser = ISUPv5Parser()
+    data = frame(7) + frame(8)
+    expected_acks = parser.make_ack(7) + parser.make_ack(8)
+
+    acks, processor = asyncio.run(_exchange([data[i : i + 1] for i in range(len(data))], len(expected_acks)))
+
+    assert acks == expected_acks
+    assert processor.processed == [frame(7), frame(8)]
+
+
+def test_heartbeat_is_acked_but_not_forwarded():
+    parser = ISUPv5Parser()
+    expected_acks = parser.make_heartbeat_ack() + parser.make_ack(3)
+
+    acks, processor = asyncio.run(_exchange([frame(2, b"") + frame(3)], len(expected_acks)))
+
+    assert acks == expected_acks
+    assert processor.processed == [frame(3)]
+
+
+def test_invalid_marker_closes_connection_after_earlier_frames():
+    parser = ISUPv5Parser()
+
+    async def run():
+        processor = FakeProcessor()
+        server, port = await _start(processor)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            writer.write(frame(1) + b"XX" + frame(2)[2:] + frame(3))
+            await writer.drain()
+            received = await asyncio.wait_for(reader.read(), 5)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+            await server.stop()
+        return received, processor
+
+    received, processor = asyncio.run(run())
+
+    # Only the frame before the bad marker is acked; the server then drops the connection
+    assert received == parser.make_ack(1)
+    assert processor.processed == [frame(1)]
+
+
+def test_stop_saves_acked_but_unprocessed_packets():
+    parser = ISUPv5Parser()
+    frames = [frame(seq) for seq in range(1, 4)]
+    expected_acks = b"".join(parser.make_ack(seq) for seq in range(1, 4))
+
+    async def run():
+        processor = FakeProcessor(block=True)
+        server, port = await _start(processor)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            writer.write(b"".join(frames))
+            await writer.drain()
+            acks = await asyncio.wait_for(reader.readexactly(len(expected_acks)), 5)
+            connections = set(server._connections)
+            await server.stop()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        return acks, processor, connections
+
+    acks, processor, connections = asyncio.run(run())
+
+    assert acks == expected_acks
+    # The save does not swallow the shutdown: connection tasks end cancelled
+    assert connections and all(task.cancelled() for task in connections)
+    assert processor.processed == []
+    assert processor.saved == frames
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _loaded_after(statement: str) -> bool:
+    code = f"import sys; {statement}; print('isapi.isapi_device_manager' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.strip() == "True"
+
+
+def test_device_manager_is_not_loaded_by_the_webhook_imports():
+    assert not _loaded_after("import main")
+
+
+def test_device_manager_is_still_exported_by_the_package():
+    assert _loaded_after("from isapi import ISAPIDeviceManager")
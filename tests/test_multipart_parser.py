@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from isapi.isapi_server import (
+    _MultipartPushParser,
+    _boundary_delimiter,
+    _parse_part,
+    _robust_parse_multipart_formdata,
+)
+
+BOUNDARY = "MIME_boundary"
+
+
+def _split_reference(body: bytes, boundary: str):
+    """
+    The original chunking: body.split(b"--" + boundary), each chunk parsed on its own.
+    """
+    parts = []
+    for chunk in body.split(_boundary_delimiter(boundary)):
+        part = _parse_part(chunk)
+        if part:
+            parts.append(part)
+    return parts
+
+
+def _feed_in_pieces(body: bytes, boundary: str, cuts):
+    parser = _MultipartPushParser(boundary)
+    parts = []
+    prev = 0
+    for cut in sorted(cuts) + [len(body)]:
+        parts.extend(parser.feed(body[prev:cut]))
+        prev = cut
+    parts.extend(parser.close())
+    return parts
+
+
+def _random_body(rnd: random.Random, boundary: str) -> bytes:
+    nl = rnd.choice([b"\r\n", b"\n"])
+    out = bytearray(b"--" + boundary.encode() + nl)
+    for i in range(rnd.randint(0, 5)):
+        kind = rnd.choice(["xml", "image", "empty", "noheaders"])
+        if kind == "xml":
+            out += b'Content-Disposition: form-data; name="MoveDetection"' + nl
+            out += b"Content-Type: application/xml" + nl + nl
+            out += b"<EventNotificationAlert><eventType>x%d</eventType></EventNotificationAlert>" % i + nl
+        elif kind == "image":
+            out += b'Content-Disposition: form-data; name="Picture"; filename="p%d.jpg"' % i + nl
+            out += b"Content-Type: image/jpeg" + nl + nl
+            # Binary payload that may contain partial delimiters and newlines
+            out += bytes(rnd.getrandbits(8) for _ in range(rnd.randint(1, 300))) + b"--MIME_bound" + nl
+        elif kind == "empty":
+            out += b"Content-Type: text/plain" + nl + nl + b"  " + nl
+        else:
+            out += b"garbage without header separator" + nl
+        out += b"--" + boundary.encode() + nl
+    out += b"--" + boundary.encode() + b"--" + nl
+    return bytes(out)
+
+
+# Fixed seeds: two LF and two CRLF bodies, each with binary image parts
+@pytest.mark.parametrize("seed", [13, 24, 26, 28])
+def test_push_parser_matches_whole_body_parser(seed):
+    rnd = random.Random(seed)
+    body = _random_body(rnd, BOUNDARY)
+    expected = _split_reference(body, BOUNDARY)
+    assert _robust_parse_multipart_formdata(body, BOUNDARY) == expected
+    for _ in range(5):
+        cuts = [rnd.randint(0, len(body)) for _ in range(rnd.randint(1, 8))]
+        assert _feed_in_pieces(body, BOUNDARY, cuts) == expected
+
+
+def test_push_parser_byte_at_a_time():
+    body = _random_body(random.Random(28), BOUNDARY)
+    assert _feed_in_pieces(body, BOUNDARY, list(range(len(body)))) == _split_reference(body, BOUNDARY)
+
+
+def test_delimiter_straddling_chunks():
+    body = (
+        b"--MIME_boundary\r\nContent-Type: application/xml\r\n\r\n<a/>\r\n"
+        b"--MIME_boundary\r\nContent-Type: image/jpeg\r\n\r\nJPEG\r\n--MIME_boundary--\r\n"
+    )
+    second = body.index(b"--MIME_boundary", 1)
+    for cut in range(second, second + len(b"--MIME_boundary") + 1):
+        parts = _feed_in_pieces(body, BOUNDARY, [cut])
+        assert [payload for _, payload in parts] == [b"<a/>", b"JPEG"]
+
+
+def test_whole_body_parser_without_boundary_or_body():
+    assert _robust_parse_multipart_formdata(b"", BOUNDARY) == []
+    assert _robust_parse_multipart_formdata(b"--x\r\n\r\nabc", "") == []
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import os
+import time
+
+from core.metrics import ServerMetrics
+from core.processor import EventProcessor
+from core.storage import _CLAIM_MARK, EventStorage
+from isup.isup_protocol import ISUPv5Parser
+
+EVENT = {"source": "ISUP", "device_id": "DEV", "card": "0A0B"}
+
+
+def _pending_names(path):
+    return sorted(name for name in os.listdir(path) if name.startswith("pending_"))
+
+
+def test_cancelled_retry_releases_its_claim(tmp_path):
+    log = logging.getLogger("test")
+    storage = EventStorage(tmp_path, 30, log)
+    processor = EventProcessor(None, None, storage, ServerMetrics(), log, ISUPv5Parser())
+
+    async def run():
+        await storage.save_event(EVENT, "t1")
+        saved = _pending_names(tmp_path)
+        sending = asyncio.Event()
+
+        async def hanging_dispatch(event_data):
+            sending.set()
+            await asyncio.Event().wait()
+
+        processor._dispatch_event = hanging_dispatch
+        task = asyncio.create_task(processor.retry_pending_events())
+        await asyncio.wait_for(sending.wait(), 5)
+        assert _CLAIM_MARK in _pending_names(tmp_path)[0]
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return saved, await storage.get_pending_events()
+
+    saved, pending = asyncio.run(run())
+
+    assert _pending_names(tmp_path) == saved
+    assert [os.path.basename(p) for p in pending] == saved
+
+
+def test_claims_of_dead_or_own_pid_are_stale(tmp_path):
+    storage = EventStorage(tmp_path, 30, logging.getLogger("test"))
+    now = int(time.time())
+    stem = f"pending_t1_1-0_{now}"
+    own = tmp_path / f"{stem}{_CLAIM_MARK}{os.getpid()}-{now}"
+    live = tmp_path / f"pending_t1_1-1_{now}{_CLAIM_MARK}{os.getppid()}-{now}"
+    for path in (own, live):
+        path.write_bytes(b"{}")
+
+    pending = storage._scan_pending()
+
+    # Our own pid means a previous process left it; the parent is alive and keeps its claim
+    assert pending == [str(own)]
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+
+from core.metrics import ServerMetrics
+from core.processor import EventProcessor
+from isup.isup_protocol import ISUPv5Parser
+
+
+class SlowStorage:
+    def __init__(self):
+        self.saved = []
+
+    async def save_event(self, event, tenant_id):
+        await asyncio.sleep(0.01)
+        self.saved.append(event)
+
+
+def test_cancelled_save_finishes_then_propagates_the_cancel():
+    storage = SlowStorage()
+    processor = EventProcessor(None, None, storage, ServerMetrics(), logging.getLogger("test"), ISUPv5Parser())
+    processor._tenant_for = lambda event_data: None
+    payloads = [{"n": n} for n in range(5)]
+
+    async def run():
+        task = asyncio.create_task(processor._save_unsent(payloads))
+        await asyncio.sleep(0)
+        # Server stop, then loop teardown: both cancellations land while saving
+        task.cancel()
+        await asyncio.sleep(0.015)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return task
+
+    task = asyncio.run(run())
+
+    assert task.cancelled()
+    assert storage.saved == payloads
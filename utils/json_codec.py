@@ -0,0 +1,22 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson as _orjson
+except ImportError:  # pragma: no cover - optional dependency
+    _orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Compact UTF-8 JSON: orjson when installed, otherwise stdlib json with the same separators.
+    """
+    if _orjson is not None:
+        return _orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
@@ -1,16 +1,53 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
+from typing import Optional
 
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", lean_records: bool = False) -> logging.Logger:
+    """
+    Log calls format the record (QueueHandler.prepare merges msg % args on the calling
+    thread) and enqueue it; a QueueListener thread does the blocking stream write, so
+    logging never stalls the event loop on I/O.
+    """
+    global _listener
 
-def setup_logging(level: str = "INFO") -> logging.Logger:
     log_level = getattr(logging, level.upper(), logging.INFO)
     fmt = "%(asctime)s | %(levelname)-5s | %(name)-20s | %(message)s"
     datefmt = "%Y-%m-%d %H:%M:%S"
 
+    if lean_records:
+        # Opt-in (server.lean_log_records): the format uses no thread/process attributes, so
+        # skip collecting them per record. These flags are process-wide, every library's
+        # records lose %(thread)d / %(process)d too; %(filename)s / %(lineno)d are unaffected
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(logging.Formatter(fmt, datefmt))
 
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    stop_logging()
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
     root = logging.getLogger()
     root.setLevel(log_level)
-    root.addHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
     return root
+
+
+def stop_logging():
+    """
+    Flush queued records and stop the listener thread (safe to call more than once).
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None